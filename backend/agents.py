@@ -4,209 +4,621 @@ Handles connections to Vertex AI reasoning engines
 """
 
 import os
+import re
 import uuid
+import secrets
 import json
 import asyncio
-import sys
-from typing import Dict, List, Optional, Any, AsyncGenerator
-from datetime import datetime
+import logging
+import time
+import threading
+import functools
+from typing import Dict, List, Optional, Any, AsyncGenerator, Tuple
+from concurrent.futures import ThreadPoolExecutor
 
 from dotenv import load_dotenv
 from vertexai import agent_engines
 from google.cloud import aiplatform
 
+from utils.utils import build_ready_state, handle_uploads_and_patch_state
 
 from .models import PipelinePayload, StageConfig, LeadData, BusinessData
+from .session_store import SessionStore
+from .state_manager import RUNTIME_SESSION_KEYS
+from .timestamps import now_iso
 
-# build_ready_state will be imported conditionally when needed
-
-# Import handle_upload_and_patch_state from utils
-def _import_handle_upload_and_patch_state():
-    """Import handle_upload_and_patch_state from utils"""
-    try:
-        import importlib.util
-        utils_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'utils', 'utils.py')
-        spec = importlib.util.spec_from_file_location("utils", utils_path)
-        utils_module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(utils_module)
-        return utils_module.handle_upload_and_patch_state
-    except Exception as e:
-        print(f"❌ Error importing handle_upload_and_patch_state: {str(e)}")
-        raise
-
-handle_upload_and_patch_state = _import_handle_upload_and_patch_state()
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Redis is optional; sessions stay in-process without it
+    aioredis = None
 
 # Load environment variables
 load_dotenv()
 
-class CRMAgentManager:
+logger = logging.getLogger(__name__)
+
+# Engine handles are shared process-wide so every manager reuses one warm connection
+ENGINE_CACHE_TTL = 600
+_engine_cache: Dict[Tuple[str, str, str], Tuple[float, Any]] = {}
+_engine_locks: Dict[Tuple[str, str, str], asyncio.Lock] = {}
+_initialized_endpoints = set()
+
+# Idle sessions drop their engine handle and cached state instead of holding them for the life of the process
+SESSION_CACHE_MAXSIZE = 10_000
+SESSION_TTL = 3600
+
+# Evicted sessions keep only their small metadata (IDs, ingested files) so they
+# can be reattached; this tier is bounded too, and forgets sessions idle for a week
+SESSION_EVICTED_MAXSIZE = 50_000
+SESSION_EVICTED_TTL = 7 * 24 * 3600
+# Large session fields that are not needed to reattach a session
+EVICTED_DROP_KEYS = frozenset(("ready_state",))
+
+# Optional out-of-process L2 session store, enabled by REDIS_URL. With it the
+# in-process store only keeps a small hot set and other workers can pick up
+# any session from Redis.
+REDIS_URL = os.getenv("REDIS_URL")
+SESSION_L1_MAXSIZE = 512
+SESSION_L1_TTL = 300
+# A session in use has its Redis expiry pushed back at most this often
+SESSION_L2_REFRESH_INTERVAL = 60
+_redis_client = None
+
+
+def _get_redis():
+    """Shared Redis client, or None when no L2 store is configured"""
+    global _redis_client
+    if _redis_client is None and REDIS_URL and aioredis is not None:
+        _redis_client = aioredis.from_url(REDIS_URL)
+    return _redis_client
+
+# Event text that signals the Omni agent's internal tools changed lead state
+TOOL_INDICATORS = (
+    "update_record_tool",
+    "move_stage_tool",
+    "success message",
+    "updated",
+    "moved to stage",
+    "stage transition",
+    "information saved",
+    "record updated",
+)
+_TOOL_INDICATOR_RE = re.compile("|".join(map(re.escape, TOOL_INDICATORS)), re.IGNORECASE)
+
+# Flattened state keys per stage (stage_1_stage_name, ...), built once instead of per call
+STAGE_FIELDS = (
+    "stage_name",
+    "stage_number",
+    "entry_condition",
+    "prompt",
+    "brief_stage_goal",
+    "fields",
+    "user_tags",
+)
+MAX_PRECOMPUTED_STAGES = 20
+_STAGE_KEYS = {
+    i: {field: f"stage_{i}_{field}" for field in STAGE_FIELDS}
+    for i in range(1, MAX_PRECOMPUTED_STAGES + 1)
+}
+# Stage fields holding lists; the rest default to ""
+LIST_STAGE_FIELDS = frozenset(("fields", "user_tags"))
+# A flattened state holding any of stages 3-9 has at least 3 stages
+_MIN_PIPELINE_PROBE_KEYS = tuple(_STAGE_KEYS[i]["stage_name"] for i in range(3, 10))
+
+
+def stage_keys(i: int) -> Dict[str, str]:
+    """Get the flattened state keys for stage i"""
+    keys = _STAGE_KEYS.get(i)
+    if keys is None:
+        keys = {field: f"stage_{i}_{field}" for field in STAGE_FIELDS}
+    return keys
+
+# Remote state only changes during a turn, so UI polls within this window reuse the last fetch
+STATE_CACHE_TTL = 1.5
+
+# Events buffered between the sync stream worker and the async consumer
+STREAM_QUEUE_SIZE = 32
+
+
+def _init_aiplatform(project_id: str, location: str):
+    """Initialize AI Platform once per (project, location)"""
+    key = (project_id, location)
+    if key not in _initialized_endpoints:
+        aiplatform.init(project=project_id, location=location)
+        _initialized_endpoints.add(key)
+
+
+# Admission control and timeouts for Vertex calls. Streams and single calls get
+# separate slots so a burst of long chats cannot starve session lookups.
+VERTEX_MAX_INFLIGHT = int(os.getenv("VERTEX_MAX_INFLIGHT", "8"))
+VERTEX_CALL_TIMEOUT = float(os.getenv("VERTEX_CALL_TIMEOUT", "30"))
+VERTEX_STREAM_IDLE_TIMEOUT = float(os.getenv("VERTEX_STREAM_IDLE_TIMEOUT", "120"))
+VERTEX_UPLOAD_TIMEOUT = float(os.getenv("VERTEX_UPLOAD_TIMEOUT", "300"))
+_call_slots = asyncio.Semaphore(VERTEX_MAX_INFLIGHT)
+_stream_slots = asyncio.Semaphore(VERTEX_MAX_INFLIGHT)
+
+# Dedicated pool for blocking Vertex SDK calls, so they neither queue behind
+# nor starve other work on the default executor
+_VERTEX_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("VERTEX_IO_THREADS", "32")),
+    thread_name_prefix="vertex-io"
+)
+
+
+async def _to_vertex(func, *args, **kwargs):
+    """Run a blocking Vertex SDK call on the dedicated I/O pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_VERTEX_EXECUTOR, functools.partial(func, *args, **kwargs))
+
+
+async def _engine_call(engine, method: str, **kwargs):
     """
-    Manages connections to the CRM Stage Builder Agent
-    Handles pipeline creation and business setup
+    Call a session method on an engine, using its native async variant when available
+    (e.g. async_get_session) and the Vertex I/O pool otherwise
+    Calls are admitted VERTEX_MAX_INFLIGHT at a time and fail after VERTEX_CALL_TIMEOUT seconds
+    """
+    async_method = getattr(engine, f"async_{method}", None)
+    if async_method is not None:
+        call = async_method(**kwargs)
+    else:
+        call = _to_vertex(getattr(engine, method), **kwargs)
+    async with _call_slots:
+        return await asyncio.wait_for(call, VERTEX_CALL_TIMEOUT)
+
+
+async def _get_engine_handle(project_id: str, location: str, agent_id: str):
+    """Get a cached engine handle, fetching it at most once per TTL window"""
+    key = (project_id, location, agent_id)
+    cached = _engine_cache.get(key)
+    if cached and time.monotonic() - cached[0] < ENGINE_CACHE_TTL:
+        return cached[1]
+
+    lock = _engine_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        # Another caller may have refreshed the handle while we waited
+        cached = _engine_cache.get(key)
+        if cached and time.monotonic() - cached[0] < ENGINE_CACHE_TTL:
+            return cached[1]
+
+        engine = await _to_vertex(agent_engines.get, agent_id)
+        _engine_cache[key] = (time.monotonic(), engine)
+        return engine
+
+
+def _coalesced_get_session(inflight: Dict[Tuple[str, str], asyncio.Future], engine, user_id: str, session_id: str) -> asyncio.Future:
+    """Fetch a remote session, sharing one in-flight RPC between concurrent callers"""
+    key = (user_id, session_id)
+    fetch = inflight.get(key)
+    if fetch is None:
+        fetch = asyncio.ensure_future(
+            _engine_call(engine, "get_session", user_id=user_id, session_id=session_id)
+        )
+        inflight[key] = fetch
+        fetch.add_done_callback(lambda _: inflight.pop(key, None))
+    # Shield so one cancelled caller does not cancel the fetch for everyone else
+    return asyncio.shield(fetch)
+
+
+async def _iter_stream_query(engine, **kwargs) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Iterate a Vertex stream query, admitting VERTEX_MAX_INFLIGHT streams at a time
+    Fails with asyncio.TimeoutError if no event arrives for VERTEX_STREAM_IDLE_TIMEOUT seconds
+    """
+    async with _stream_slots:
+        events = _stream_events(engine, **kwargs)
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(events.__anext__(), VERTEX_STREAM_IDLE_TIMEOUT)
+                except StopAsyncIteration:
+                    break
+                yield event
+        finally:
+            await events.aclose()
+
+
+async def _stream_events(engine, **kwargs) -> AsyncGenerator[Dict[str, Any], None]:
+    """Iterate a Vertex stream query without blocking the event loop"""
+    async_stream_query = getattr(engine, "async_stream_query", None)
+    if async_stream_query is not None:
+        async for event in async_stream_query(**kwargs):
+            yield event
+        return
+
+    # Older engines only expose the sync generator. A worker thread drains it
+    # into a bounded queue so the SDK fetches the next event while the caller
+    # is still handling the current one.
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    done = object()
+    stopped = threading.Event()
+
+    def _put(item):
+        # Blocks the worker while the queue is full
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def _producer():
+        try:
+            for event in engine.stream_query(**kwargs):
+                if stopped.is_set():
+                    return
+                _put(event)
+            _put(done)
+        except BaseException as e:
+            if not stopped.is_set():
+                _put(e)
+
+    loop.run_in_executor(_VERTEX_EXECUTOR, _producer)
+    try:
+        while True:
+            event = await queue.get()
+            if event is done:
+                break
+            if isinstance(event, BaseException):
+                raise event
+            yield event
+    finally:
+        stopped.set()
+        # Unblock a worker waiting on a full queue so it can see the stop flag
+        while not queue.empty():
+            queue.get_nowait()
+
+
+class BaseAgentManager:
+    """
+    Shared engine and session handling for the agent managers
     """
     
-    def __init__(self):
-        self.agent_id = os.getenv("CRM_STAGE_AGENT")
+    # Redis key prefix for this manager's sessions
+    session_key_prefix = "agent"
+    
+    def __init__(self, agent_id: Optional[str]):
+        self.agent_id = agent_id
         self.project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
         self.location = os.getenv("GOOGLE_CLOUD_LOCATION")
         self.engine = None
-        self.active_sessions = {}
+        self._redis = _get_redis()
+        # Metadata of sessions evicted from the local store, so they can be
+        # reattached on their next use; the remote session is never deleted
+        self._evicted = SessionStore(maxsize=SESSION_EVICTED_MAXSIZE, ttl=SESSION_EVICTED_TTL)
+        if self._redis is not None:
+            # Sessions evicted from the hot set live on in Redis
+            self.active_sessions = SessionStore(maxsize=SESSION_L1_MAXSIZE, ttl=SESSION_L1_TTL)
+        else:
+            self.active_sessions = SessionStore(
+                maxsize=SESSION_CACHE_MAXSIZE,
+                ttl=SESSION_TTL,
+                on_evict=self._remember_evicted
+            )
+        self._inflight_get: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._reaper_task = None
         
         # Initialize AI Platform
-        aiplatform.init(project=self.project_id, location=self.location)
-        
-        print(f"🤖 CRM Agent Manager initialized with agent: {self.agent_id}")
+        _init_aiplatform(self.project_id, self.location)
+    
+    def start_reaper(self, interval: int = 60):
+        """Start a task that expires idle sessions every interval seconds, even without traffic"""
+        if self._reaper_task is None:
+            self._reaper_task = asyncio.create_task(self._reaper_loop(interval))
+    
+    async def _reaper_loop(self, interval: int):
+        """Session reaper loop"""
+        while True:
+            await asyncio.sleep(interval)
+            expired = self.active_sessions.expire()
+            self._evicted.expire()
+            if expired:
+                logger.info("🧹 Expired %d idle %s sessions", expired, self.session_key_prefix)
     
-    def _get_engine(self):
-        """Get the engine handle (lazy loading)"""
-        if self.engine is None:
-            self.engine = agent_engines.get(self.agent_id)
+    def stop_reaper(self):
+        """Stop the session reaper task"""
+        if self._reaper_task:
+            self._reaper_task.cancel()
+            self._reaper_task = None
+    
+    async def _get_engine(self):
+        """Get the engine handle (shared across manager instances)"""
+        self.engine = await _get_engine_handle(self.project_id, self.location, self.agent_id)
         return self.engine
     
+    def _session_key(self, session_id: str) -> str:
+        return f"{self.session_key_prefix}:{session_id}"
+    
+    @staticmethod
+    def _session_metadata(session_data: Dict[str, Any]) -> Dict[str, Any]:
+        """A session without its live engine handle and cached remote state"""
+        return {k: v for k, v in session_data.items() if k not in RUNTIME_SESSION_KEYS}
+    
+    def _remember_evicted(self, session_id: str, session_data: Dict[str, Any]):
+        """Keep an evicted session's metadata; its remote session stays alive"""
+        self._evicted[session_id] = {
+            k: v for k, v in self._session_metadata(session_data).items() if k not in EVICTED_DROP_KEYS
+        }
+    
+    async def _persist_session(self, session_data: Dict[str, Any]):
+        """Write a session's metadata to the L2 store, if one is configured"""
+        if self._redis is None:
+            return
+        payload = self._session_metadata(session_data)
+        try:
+            await self._redis.set(self._session_key(session_data["session_id"]), json.dumps(payload), ex=SESSION_TTL)
+        except Exception as e:
+            logger.warning("⚠️ Could not persist session %s: %s", session_data["session_id"], e)
+    
+    async def _touch_persisted_session(self, session_data: Dict[str, Any]):
+        """Push back a session's L2 expiry while it is in use, like the local store's idle timer"""
+        now = time.monotonic()
+        refreshed_at = session_data.get("l2_refreshed_at")
+        if refreshed_at is not None and now - refreshed_at < SESSION_L2_REFRESH_INTERVAL:
+            return
+        session_data["l2_refreshed_at"] = now
+        try:
+            if not await self._redis.expire(self._session_key(session_data["session_id"]), SESSION_TTL):
+                # The L2 copy already expired; write it back from the local one
+                await self._persist_session(session_data)
+        except Exception as e:
+            logger.warning("⚠️ Could not refresh session %s: %s", session_data["session_id"], e)
+    
+    async def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Look up a session in the local store, then in the L2 store or the evicted sessions"""
+        session = self.active_sessions.get(session_id)
+        if session is not None:
+            if self._redis is not None:
+                await self._touch_persisted_session(session)
+            return session
+        
+        if self._redis is None:
+            session = self._evicted.pop(session_id, None)
+            if session is None:
+                return None
+        else:
+            try:
+                raw = await self._redis.get(self._session_key(session_id))
+            except Exception as e:
+                logger.warning("⚠️ Could not load session %s: %s", session_id, e)
+                return None
+            if raw is None:
+                return None
+            session = json.loads(raw)
+            await self._touch_persisted_session(session)
+        
+        # Rehydrate with a live engine handle and keep it hot locally
+        session["engine"] = await self._get_engine()
+        async with self.active_sessions.lock(session_id):
+            self.active_sessions[session_id] = session
+        return session
+    
+    async def _forget_session(self, session_id: str):
+        """Drop a session from the L2 store"""
+        if self._redis is None:
+            return
+        try:
+            await self._redis.delete(self._session_key(session_id))
+        except Exception as e:
+            logger.warning("⚠️ Could not delete session %s: %s", session_id, e)
+    
+    async def _forget_all_sessions(self):
+        """Drop every session of this manager from the evicted sessions and the L2 store"""
+        await self._evicted.clear()
+        if self._redis is None:
+            return
+        try:
+            keys = [key async for key in self._redis.scan_iter(match=self._session_key("*"))]
+            if keys:
+                await self._redis.delete(*keys)
+        except Exception as e:
+            logger.warning("⚠️ Could not clear persisted sessions: %s", e)
+    
+    async def _get_session_state(self, session_id: str, max_age: float = STATE_CACHE_TTL) -> Dict[str, Any]:
+        """Get a session's remote state, reusing a fetch younger than max_age seconds"""
+        session = self.active_sessions[session_id]
+        cached = session.get("state_cache")
+        if cached and time.monotonic() - cached[0] < max_age:
+            return cached[1]
+
+        remote_session = await _coalesced_get_session(
+            self._inflight_get,
+            session["engine"],
+            session["user_id"],
+            session_id
+        )
+        state = remote_session.get("state", {})
+        session["state_cache"] = (time.monotonic(), state)
+        return state
+    
+    def event_text_parts(self, event: Any) -> List[str]:
+        """Text parts carried by a single streamed event"""
+        if not isinstance(event, dict):
+            return []
+        # Extract text from content with a single lookup per part
+        content = event.get("content") or {}
+        return [
+            text
+            for part_item in content.get("parts", ())
+            if (text := part_item.get("text")) is not None
+        ]
+    
+    def join_text_parts(self, text_parts: List[str]) -> str:
+        """Join text collected from streamed events into a single text response"""
+        return "\n".join(text_parts) if text_parts else "Response received"
+    
+    def combine_response_parts(self, response_parts: List[Dict[str, Any]]) -> str:
+        """Combine response parts into a single text response"""
+        text_parts = []
+        
+        for part in response_parts:
+            text_parts.extend(self.event_text_parts(part))
+        
+        return self.join_text_parts(text_parts)
+
+
+class CRMAgentManager(BaseAgentManager):
+    """
+    Manages connections to the CRM Stage Builder Agent
+    Handles pipeline creation and business setup
+    """
+    
+    session_key_prefix = "crm"
+    
+    def __init__(self):
+        super().__init__(os.getenv("CRM_STAGE_AGENT"))
+        
+        logger.info("🤖 CRM Agent Manager initialized with agent: %s", self.agent_id)
+    
     async def get_or_create_session(self, session_id: Optional[str] = None) -> Dict[str, Any]:
         """Get existing session or create a new one"""
-        if session_id and session_id in self.active_sessions:
-            return self.active_sessions[session_id]
+        if session_id:
+            session = await self.get_session(session_id)
+            if session is not None:
+                return session
         
         # Create new session
-        engine = self._get_engine()
-        user_id = f"owner_{uuid.uuid4().hex[:8]}"
+        engine = await self._get_engine()
+        user_id = f"owner_{secrets.token_hex(4)}"
         
-        session = engine.create_session(user_id=user_id)
+        session = await _engine_call(engine, "create_session", user_id=user_id)
         
         session_data = {
             "session_id": session["id"],
             "user_id": session["userId"],
             "engine": engine,
-            "created_at": datetime.now().isoformat()
+            "created_at": now_iso()
         }
         
         # Store session
-        self.active_sessions[session["id"]] = session_data
+        async with self.active_sessions.lock(session["id"]):
+            self.active_sessions[session["id"]] = session_data
+        await self._persist_session(session_data)
         
-        print(f"🆔 Created CRM session: {session['id']} for user: {user_id}")
+        logger.info("🆔 Created CRM session: %s for user: %s", session["id"], user_id)
         return session_data
     
     async def stream_query(self, session_id: str, message: str) -> AsyncGenerator[Dict[str, Any], None]:
         """Stream a query to the CRM agent"""
-        if session_id not in self.active_sessions:
+        session = await self.get_session(session_id)
+        if session is None:
             raise ValueError(f"Session {session_id} not found")
-        
-        session = self.active_sessions[session_id]
         engine = session["engine"]
         
-        print(f"📤 Sending to CRM agent: {message[:100]}...")
+        logger.debug("📤 Sending to CRM agent: %.100s...", message)
         
         # Stream the response
-        for event in engine.stream_query(
+        async for event in _iter_stream_query(
+            engine,
             user_id=session["user_id"],
             session_id=session_id,
             message=message
         ):
             yield event
-    
-    def combine_response_parts(self, response_parts: List[Dict[str, Any]]) -> str:
-        """Combine response parts into a single text response"""
-        text_parts = []
-        
-        for part in response_parts:
-            if isinstance(part, dict):
-                # Extract text from content
-                content = part.get("content", {})
-                if "parts" in content:
-                    for part_item in content["parts"]:
-                        if "text" in part_item:
-                            text_parts.append(part_item["text"])
         
-        return "\n".join(text_parts) if text_parts else "Response received"
+        # The turn may have changed remote state
+        session.pop("state_cache", None)
     
     async def handle_file_upload(self, session_id: str, file_path: str, filename: str):
-        """Handle file upload to the CRM agent session using the utility function"""
-        if session_id not in self.active_sessions:
+        """Handle a single file upload to the CRM agent session"""
+        await self.handle_file_uploads(session_id, [{"path": file_path, "name": filename}])
+    
+    async def handle_file_uploads(self, session_id: str, files: List[Dict[str, str]]):
+        """
+        Upload several files to the CRM agent session using the utility function
+        New files share one corpus import and one session state patch
+        """
+        session = await self.get_session(session_id)
+        if session is None:
             raise ValueError(f"Session {session_id} not found")
         
-        session = self.active_sessions[session_id]
-        engine = session["engine"]
+        # Uploads are content-addressed, so the same path means the same bytes
+        ingested_files = session.setdefault("ingested_files", [])
+        pending: Dict[str, str] = {}
+        for file_info in files:
+            file_path, filename = file_info["path"], file_info["name"]
+            if file_path in ingested_files or file_path in pending:
+                logger.info("📁 File %s already ingested in CRM session %s, skipping", filename, session_id)
+                continue
+            pending[file_path] = filename
+        if not pending:
+            return
         
-        print(f"📁 Uploading file {filename} to CRM session {session_id}")
+        filenames = ", ".join(pending.values())
+        logger.info("📁 Uploading %d file(s) to CRM session %s: %s", len(pending), session_id, filenames)
         
         try:
             # Use the utility function for file upload and RAG corpus integration
-            await handle_upload_and_patch_state(
-                self.agent_id,  # Pass the full agent ID
-                file_path,
-                user_id=session["user_id"],
-                session_id=session_id
+            await asyncio.wait_for(
+                handle_uploads_and_patch_state(
+                    self.agent_id,  # Pass the full agent ID
+                    list(pending),
+                    user_id=session["user_id"],
+                    session_id=session_id
+                ),
+                VERTEX_UPLOAD_TIMEOUT
             )
-            
-            print(f"✅ File {filename} uploaded successfully to RAG corpus")
-            
         except Exception as e:
-            print(f"❌ File upload error: {str(e)}")
+            logger.error("❌ File upload error: %s", e)
             raise
+        
+        # Only marked once the session state has been patched
+        ingested_files.extend(pending)
+        await self._persist_session(session)
+        logger.info("✅ Files %s uploaded successfully to RAG corpus", filenames)
+    
+    async def get_state(self, session_id: str) -> Dict[str, Any]:
+        """
+        Fetch a session's current remote state with a single get_session call
+        Pass the result to is_pipeline_complete_from_state / extract_pipeline_payload_from_state
+        """
+        if await self.get_session(session_id) is None:
+            raise ValueError(f"Session {session_id} not found")
+        return await self._get_session_state(session_id)
     
     async def is_pipeline_complete(self, session_id: str) -> bool:
         """Check if the pipeline creation is complete using multiple indicators"""
-        if session_id not in self.active_sessions:
+        if await self.get_session(session_id) is None:
             return False
         
-        session = self.active_sessions[session_id]
-        engine = session["engine"]
-        
         try:
             # Get session state using the correct method
-            remote_session_state = engine.get_session(
-                user_id=session["user_id"],
-                session_id=session_id
-            )
-            
-            state = remote_session_state.get('state', {})
+            state = await self._get_session_state(session_id)
             return await self.is_pipeline_complete_from_state(state)
             
         except Exception as e:
-            print(f"❌ Error checking pipeline status: {str(e)}")
+            logger.error("❌ Error checking pipeline status: %s", e)
             return False
     
     async def is_pipeline_complete_from_state(self, state: dict) -> bool:
         """Check if the pipeline creation is complete using session state directly"""
         try:
-            print(f"📋 Checking pipeline completion. Top-level keys: {list(state.keys())}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("📋 Checking pipeline completion. Top-level keys: %s", list(state.keys()))
             
-            # Check multiple indicators for completion (per user's explanation)
-            is_complete = False
-            
-            # 1. Check if pipeline.pipeline_completed is True
-            if 'pipeline' in state and isinstance(state['pipeline'], dict):
-                pipeline_completed = state['pipeline'].get('pipeline_completed', False)
-                print(f"🔍 pipeline.pipeline_completed: {pipeline_completed}")
-                if pipeline_completed:
-                    is_complete = True
-            
-            # 2. Check if stages exist in pipeline.stage_design_results.stages
-            if 'pipeline' in state and 'stage_design_results' in state['pipeline']:
-                stages = state['pipeline']['stage_design_results'].get('stages', [])
-                print(f"🔍 Found {len(stages)} stages in stage_design_results")
-                if len(stages) >= 3:  # User specified 3-4 stages
-                    # Check if at least the first stage has a goal
-                    if stages and stages[0].get('brief_stage_goal'):
-                        print(f"🔍 First stage has goal: {stages[0]['brief_stage_goal'][:50]}...")
-                        is_complete = True
+            # Check multiple indicators for completion (per user's explanation),
+            # returning on the first one that holds
+            pipeline = state.get('pipeline')
+            if isinstance(pipeline, dict):
+                # 1. Check if pipeline.pipeline_completed is True
+                if pipeline.get('pipeline_completed'):
+                    logger.debug("🔍 pipeline.pipeline_completed is set")
+                    return True
+                
+                # 2. Check if stages exist in pipeline.stage_design_results.stages
+                stage_design_results = pipeline.get('stage_design_results')
+                if isinstance(stage_design_results, dict):
+                    stages = stage_design_results.get('stages') or []
+                    # User specified 3-4 stages; check that at least the first stage has a goal
+                    if len(stages) >= 3 and stages[0].get('brief_stage_goal'):
+                        logger.debug("🔍 Found %d designed stages, first goal: %.50s...", len(stages), stages[0]['brief_stage_goal'])
+                        return True
             
             # 3. Check if we have flattened stage data directly in state
-            stage_count = 0
-            for i in range(1, 10):  # Check up to 9 stages
-                if f'stage_{i}_stage_name' in state:
-                    stage_count = i
-            
-            if stage_count >= 3:
-                print(f"🔍 Found {stage_count} flattened stages in state")
-                is_complete = True
+            if any(key in state for key in _MIN_PIPELINE_PROBE_KEYS):
+                logger.debug("🔍 Found at least 3 flattened stages in state")
+                return True
             
-            print(f"🔍 Final pipeline completion status: {is_complete}")
-            return bool(is_complete)
+            logger.debug("🔍 Pipeline not complete yet")
+            return False
             
         except Exception as e:
-            print(f"❌ Error checking pipeline status from state: {str(e)}")
+            logger.error("❌ Error checking pipeline status from state: %s", e)
             return False
     
     def extract_business_data(self, state: dict) -> dict:
@@ -220,213 +632,195 @@ class CRMAgentManager:
     
     def build_stages(self, state: dict) -> List[dict]:
         """Build stages list from state using the pattern from crm_agent_pipeline.py"""
+        # A raw session state already holds the stages as records; only normalise their fields
+        pipeline = state.get("pipeline")
+        if isinstance(pipeline, dict):
+            stage_records = (pipeline.get("stage_design_results") or {}).get("stages")
+            if isinstance(stage_records, list):
+                return [
+                    {field: stage.get(field, [] if field in LIST_STAGE_FIELDS else "") for field in STAGE_FIELDS}
+                    for stage in stage_records
+                ]
+        
+        # Flattened (ready) state: look up stage_{i}_{field} keys
         total = int(state.get("total_stages", 0))
-        stages = []
-        for i in range(1, total + 1):
-            stages.append({
-                "stage_name": state.get(f"stage_{i}_stage_name", ""),
-                "stage_number": state.get(f"stage_{i}_stage_number", ""),
-                "entry_condition": state.get(f"stage_{i}_entry_condition", ""),
-                "prompt": state.get(f"stage_{i}_prompt", ""),
-                "brief_stage_goal": state.get(f"stage_{i}_brief_stage_goal", ""),
-                "fields": state.get(f"stage_{i}_fields", []),
-                "user_tags": state.get(f"stage_{i}_user_tags", []),
-            })
-        return stages
+        return [
+            {field: state.get(key, [] if field in LIST_STAGE_FIELDS else "") for field, key in stage_keys(i).items()}
+            for i in range(1, total + 1)
+        ]
     
     async def extract_pipeline_payload(self, session_id: str) -> Optional[PipelinePayload]:
         """Extract the complete pipeline payload from the session state using build_ready_state"""
-        if session_id not in self.active_sessions:
+        if await self.get_session(session_id) is None:
             return None
 
-        session = self.active_sessions[session_id]
-        engine = session["engine"]
-
         try:
             # Get session state
-            remote_session_state = engine.get_session(
-                user_id=session["user_id"],
-                session_id=session_id
-            )
-
-            raw_state = remote_session_state.get("state", {})
+            raw_state = await self._get_session_state(session_id)
             return await self.extract_pipeline_payload_from_state(raw_state)
             
         except Exception as e:
-            print(f"❌ Error extracting pipeline payload: {str(e)}")
+            logger.error("❌ Error extracting pipeline payload: %s", e)
             return None
 
     async def extract_pipeline_payload_from_state(self, raw_state: dict) -> Optional[PipelinePayload]:
         """Extract the complete pipeline payload from session state directly"""
         try:
-            print(f"🔧 Extracting pipeline from raw state with keys: {list(raw_state.keys())}")
-            
-            # Import build_ready_state conditionally
-            try:
-                import sys
-                import os
-                import importlib.util
-                
-                # Direct import from utils.py file
-                utils_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'utils', 'utils.py')
-                spec = importlib.util.spec_from_file_location("utils", utils_path)
-                utils_module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(utils_module)
-                build_ready_state = utils_module.build_ready_state
-                
-                print("✅ Successfully imported build_ready_state")
-            except Exception as e:
-                print(f"⚠️ Could not import build_ready_state: {str(e)}")
-                return None
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("🔧 Extracting pipeline from raw state with keys: %s", list(raw_state.keys()))
             
             # Use build_ready_state to properly flatten the state
             ready_state = await build_ready_state(raw_state, current_stage=1)
-            print(f"✅ Built ready state with {ready_state.get('total_stages', 0)} stages")
+            logger.debug("✅ Built ready state with %s stages", ready_state.get('total_stages', 0))
             
             # Validate we have at least 3 stages as required by user
             total_stages = ready_state.get('total_stages', 0)
             if total_stages < 3 or total_stages > 4:
-                print(f"⚠️ Pipeline has {total_stages} stages, expected 3-4. Adjusting...")
+                logger.warning("⚠️ Pipeline has %s stages, expected 3-4. Adjusting...", total_stages)
                 # If we have stages but wrong count, try to extract what we can
                 if total_stages == 0:
                     return None
             
-            # Extract business data from ready state
-            business_data = {
-                "biz_name": ready_state.get("biz_name", ""),
-                "biz_info": ready_state.get("biz_info", ""),
-                "goal": ready_state.get("goal", ""),
-                "business_id": ready_state.get("business_id", str(uuid.uuid4())),
-            }
-            
-            # Build stages from flattened ready state
+            # Build stages straight from the flattened ready state
             stages = []
             for i in range(1, total_stages + 1):
-                stage_data = {
-                    "stage_name": ready_state.get(f"stage_{i}_stage_name", f"Stage {i}"),
-                    "stage_number": i,
-                    "entry_condition": ready_state.get(f"stage_{i}_entry_condition", ""),
-                    "prompt": ready_state.get(f"stage_{i}_prompt", ""),
-                    "brief_stage_goal": ready_state.get(f"stage_{i}_brief_stage_goal", ""),
-                    "fields": ready_state.get(f"stage_{i}_fields", []),
-                    "user_tags": ready_state.get(f"stage_{i}_user_tags", []),
-                }
-                
-                # Convert to StageConfig object
+                keys = stage_keys(i)
                 stage = StageConfig(
-                    stage_name=stage_data["stage_name"],
-                    stage_number=stage_data["stage_number"],
-                    entry_condition=stage_data["entry_condition"],
-                    prompt=stage_data["prompt"],
-                    brief_stage_goal=stage_data["brief_stage_goal"],
-                    fields=stage_data["fields"],
-                    user_tags=stage_data["user_tags"]
+                    stage_name=ready_state.get(keys["stage_name"], f"Stage {i}"),
+                    stage_number=i,
+                    entry_condition=ready_state.get(keys["entry_condition"], ""),
+                    prompt=ready_state.get(keys["prompt"], ""),
+                    brief_stage_goal=ready_state.get(keys["brief_stage_goal"], ""),
+                    fields=ready_state.get(keys["fields"], []),
+                    user_tags=ready_state.get(keys["user_tags"], [])
                 )
                 stages.append(stage)
-                print(f"📋 Built stage {i}: {stage_data['stage_name']}")
+                logger.debug("📋 Built stage %d: %s", i, stage.stage_name)
             
             if not stages:
-                print("❌ No stages found in ready state")
+                logger.warning("❌ No stages found in ready state")
                 return None
             
-            # Create pipeline payload
+            # Only mint an ID when the state has none
+            business_id = ready_state.get("business_id")
+            if business_id is None:
+                business_id = str(uuid.uuid4())
+            
+            # Create pipeline payload from business data in ready state
             pipeline_payload = PipelinePayload(
-                business_id=business_data["business_id"],
-                biz_name=business_data["biz_name"],
-                biz_info=business_data["biz_info"],
-                goal=business_data["goal"],
+                business_id=business_id,
+                biz_name=ready_state.get("biz_name", ""),
+                biz_info=ready_state.get("biz_info", ""),
+                goal=ready_state.get("goal", ""),
                 total_stages=total_stages,
                 stages=stages,
                 pipeline_completed=True,
-                created_at=datetime.now().isoformat()
+                created_at=now_iso()
             )
             
-            print(f"✅ Extracted pipeline: {business_data['biz_name']} with {total_stages} stages")
+            logger.debug("✅ Extracted pipeline: %s with %s stages", pipeline_payload.biz_name, total_stages)
             return pipeline_payload
             
         except Exception as e:
-            print(f"❌ Error extracting pipeline payload from state: {str(e)}")
+            logger.error("❌ Error extracting pipeline payload from state: %s", e)
             return None
     
     async def cleanup_session(self, session_id: str):
         """Clean up a CRM session"""
-        if session_id in self.active_sessions:
-            del self.active_sessions[session_id]
-            print(f"🗑️ Cleaned up CRM session: {session_id}")
+        async with self.active_sessions.lock(session_id):
+            removed = self.active_sessions.pop(session_id)
+        self._evicted.pop(session_id, None)
+        await self._forget_session(session_id)
+        if removed is not None:
+            logger.info("🗑️ Cleaned up CRM session: %s", session_id)
     
     async def reset_session(self):
         """Reset all CRM agent sessions"""
-        session_count = len(self.active_sessions)
-        self.active_sessions.clear()
-        print(f"🔄 Reset {session_count} CRM sessions")
+        session_count = await self.active_sessions.clear()
+        await self._forget_all_sessions()
+        logger.info("🔄 Reset %d CRM sessions", session_count)
 
 
-class OmniAgentManager:
+class OmniAgentManager(BaseAgentManager):
     """
     Manages connections to the Omni Stage Agent
     Handles lead conversations and state tracking
     """
     
+    session_key_prefix = "omni"
+    
     def __init__(self):
-        self.agent_id = os.getenv("OMNI_STAGE_AGENT")
-        self.project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
-        self.location = os.getenv("GOOGLE_CLOUD_LOCATION")
-        self.engine = None
-        self.active_sessions = {}
+        super().__init__(os.getenv("OMNI_STAGE_AGENT"))
         
-        # Initialize AI Platform
-        aiplatform.init(project=self.project_id, location=self.location)
+        # Bounds concurrent session creation when leads are created in bulk
+        self._create_sem = asyncio.Semaphore(int(os.getenv("VERTEX_MAX_CONCURRENCY", "16")))
         
-        print(f"🤖 Omni Agent Manager initialized with agent: {self.agent_id}")
-    
-    def _get_engine(self):
-        """Get the engine handle (lazy loading)"""
-        if self.engine is None:
-            self.engine = agent_engines.get(self.agent_id)
-        return self.engine
+        logger.info("🤖 Omni Agent Manager initialized with agent: %s", self.agent_id)
     
     async def create_lead_session(self, ready_state: Dict[str, Any], lead_id: Optional[str] = None) -> Dict[str, Any]:
         """Create a new lead session with the ready state from CRM pipeline"""
-        engine = self._get_engine()
-        user_id = f"lead_{uuid.uuid4().hex[:8]}" if not lead_id else lead_id
+        engine = await self._get_engine()
+        user_id = f"lead_{secrets.token_hex(4)}" if not lead_id else lead_id
         
-        print(f"🚀 Creating Omni session with ready state for lead: {user_id}")
+        logger.info("🚀 Creating Omni session with ready state for lead: %s", user_id)
         
         # Create session with the ready state
-        session = engine.create_session(user_id=user_id, state=ready_state)
+        session = await _engine_call(engine, "create_session", user_id=user_id, state=ready_state)
         
         session_data = {
             "session_id": session["id"],
             "user_id": session["userId"],
             "engine": engine,
             "ready_state": ready_state,
-            "created_at": datetime.now().isoformat(),
-            "last_state_update": datetime.now().isoformat()
+            "created_at": now_iso(),
+            "last_state_update": now_iso()
         }
         
         # Store session
-        self.active_sessions[session["id"]] = session_data
+        async with self.active_sessions.lock(session["id"]):
+            self.active_sessions[session["id"]] = session_data
+        await self._persist_session(session_data)
         
-        print(f"✅ Created Omni session: {session['id']} for lead: {user_id}")
-        print(f"📊 Initial state keys: {len(ready_state)} keys")
+        logger.info("✅ Created Omni session: %s for lead: %s", session["id"], user_id)
+        logger.info("📊 Initial state keys: %d keys", len(ready_state))
         
         return session_data
     
+    async def create_lead_sessions(
+        self,
+        ready_states: List[Dict[str, Any]],
+        lead_ids: Optional[List[Optional[str]]] = None
+    ) -> List[Any]:
+        """
+        Create several lead sessions concurrently
+        Returns the session data for each ready state, or the exception raised creating it
+        """
+        lead_ids = lead_ids or [None] * len(ready_states)
+        
+        async def _create(ready_state: Dict[str, Any], lead_id: Optional[str]):
+            async with self._create_sem:
+                return await self.create_lead_session(ready_state, lead_id)
+        
+        return await asyncio.gather(
+            *(_create(ready_state, lead_id) for ready_state, lead_id in zip(ready_states, lead_ids)),
+            return_exceptions=True
+        )
+    
     async def stream_query(self, session_id: str, message: str) -> AsyncGenerator[Dict[str, Any], None]:
         """Stream a query to the Omni agent and track state changes"""
-        if session_id not in self.active_sessions:
+        session = await self.get_session(session_id)
+        if session is None:
             raise ValueError(f"Session {session_id} not found")
-        
-        session = self.active_sessions[session_id]
         engine = session["engine"]
         
-        print(f"📤 Sending to Omni agent: {message[:100]}...")
+        logger.debug("📤 Sending to Omni agent: %.100s...", message)
         
         # Track state changes
         state_changes = []
         
         # Stream the response
-        for event in engine.stream_query(
+        async for event in _iter_stream_query(
+            engine,
             user_id=session["user_id"],
             session_id=session_id,
             message=message
@@ -436,97 +830,65 @@ class OmniAgentManager:
                 # Look for tool usage indicators
                 if self._is_state_change_event(event):
                     state_changes.append(event)
-                    print(f"🔧 Detected state change event: {event.get('type', 'unknown')}")
+                    logger.debug("🔧 Detected state change event: %s", event.get('type', 'unknown'))
             
             yield event
         
+        # The turn may have changed remote state
+        session.pop("state_cache", None)
+        
         # Update our local tracking if state changes occurred
         if state_changes:
             await self._handle_state_changes(session_id, state_changes)
     
-    def combine_response_parts(self, response_parts: List[Dict[str, Any]]) -> str:
-        """Combine response parts into a single text response"""
-        text_parts = []
-        
-        for part in response_parts:
-            if isinstance(part, dict):
-                # Extract text from content
-                content = part.get("content", {})
-                if "parts" in content:
-                    for part_item in content["parts"]:
-                        if "text" in part_item:
-                            text_parts.append(part_item["text"])
-        
-        return "\n".join(text_parts) if text_parts else "Response received"
-    
     def _is_state_change_event(self, event: Dict[str, Any]) -> bool:
         """Check if an event indicates a state change from internal tools"""
-        # Convert event to string for pattern matching
-        event_str = str(event).lower()
-        
-        # Look for tool usage patterns
-        tool_indicators = [
-            "update_record_tool",
-            "move_stage_tool", 
-            "success message",
-            "updated",
-            "moved to stage",
-            "stage transition",
-            "information saved",
-            "record updated"
-        ]
-        
-        # Check if any tool indicators are present
-        for indicator in tool_indicators:
-            if indicator in event_str:
-                print(f"🔧 State change detected: '{indicator}' found in event")
-                return True
+        content = event.get("content")
+        if not isinstance(content, dict):
+            return False
         
-        # Also check the content structure more thoroughly
-        content = event.get("content", {})
-        if isinstance(content, dict):
-            parts = content.get("parts", [])
-            for part in parts:
-                if isinstance(part, dict):
-                    text = part.get("text", "").lower()
-                    for indicator in tool_indicators:
-                        if indicator in text:
-                            print(f"🔧 State change detected in text: '{indicator}'")
-                            return True
+        # Only scan the fields that can carry an indicator: part text and tool call names
+        for part in content.get("parts", ()):
+            if not isinstance(part, dict):
+                continue
+            for value in (
+                part.get("text"),
+                (part.get("function_call") or {}).get("name"),
+                (part.get("function_response") or {}).get("name"),
+            ):
+                if value:
+                    match = _TOOL_INDICATOR_RE.search(value)
+                    if match:
+                        logger.debug("🔧 State change detected: '%s' found in event", match.group(0))
+                        return True
         
         return False
     
     async def _handle_state_changes(self, session_id: str, state_changes: List[Dict[str, Any]]):
         """Handle state changes from Omni agent internal tools"""
-        if session_id not in self.active_sessions:
+        session = await self.get_session(session_id)
+        if session is None:
             return
         
-        session = self.active_sessions[session_id]
-        engine = session["engine"]
-        
         try:
-            # Get the updated state from the agent
-            remote_session = engine.get_session(
-                user_id=session["user_id"],
-                session_id=session_id
-            )
-            
-            updated_state = remote_session.get("state", {})
+            # Get the updated state from the agent, bypassing the state cache
+            updated_state = await self._get_session_state(session_id, max_age=0)
             
             # Extract lead data from the updated state
             lead_data = self._extract_lead_data(updated_state, session_id)
             
-            print(f"📊 State updated for lead: {lead_data.get('name', 'Unknown')}")
-            print(f"🎯 Current stage: {lead_data.get('stage', 1)}")
+            logger.debug("📊 State updated for lead: %s", lead_data.get('name', 'Unknown'))
+            logger.debug("🎯 Current stage: %s", lead_data.get('stage', 1))
             
             # Update our session tracking
-            session["last_state_update"] = datetime.now().isoformat()
+            session["last_state_update"] = now_iso()
+            await self._persist_session(session)
             
             # Return the updated lead data for the caller to handle
             return lead_data
             
         except Exception as e:
-            print(f"❌ Error handling state changes: {str(e)}")
+            logger.error("❌ Error handling state changes: %s", e)
             return None
     
     def _extract_lead_data(self, state: Dict[str, Any], session_id: str) -> Dict[str, Any]:
@@ -544,41 +906,53 @@ class OmniAgentManager:
             "notes": state.get("Notes", ""),
             "stage": int(state.get("current_stage", 1)),
             "user_tags": state.get("current_stage_user_tags", []),
-            "updated_at": datetime.now().isoformat()
+            "updated_at": now_iso()
         }
     
     async def get_lead_data(self, session_id: str) -> Optional[Dict[str, Any]]:
         """Get current lead data from the Omni agent state"""
-        if session_id not in self.active_sessions:
+        if await self.get_session(session_id) is None:
             return None
         
-        session = self.active_sessions[session_id]
-        engine = session["engine"]
-        
         try:
             # Get current state from agent
-            remote_session = engine.get_session(
-                user_id=session["user_id"],
-                session_id=session_id
-            )
-            
-            current_state = remote_session.get("state", {})
+            current_state = await self._get_session_state(session_id)
             
             # Extract and return lead data
             return self._extract_lead_data(current_state, session_id)
             
         except Exception as e:
-            print(f"❌ Error getting lead data: {str(e)}")
+            logger.error("❌ Error getting lead data: %s", e)
             return None
     
+    async def get_lead_data_many(self, session_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Get lead data for several sessions concurrently
+        Sessions that are unknown or fail to load are left out of the result
+        State fetches share the process-wide _call_slots limit with every other caller
+        """
+        session_ids = list(dict.fromkeys(session_ids))
+        results = await asyncio.gather(
+            *(self.get_lead_data(session_id) for session_id in session_ids),
+            return_exceptions=True
+        )
+        return {
+            session_id: lead_data
+            for session_id, lead_data in zip(session_ids, results)
+            if lead_data and not isinstance(lead_data, BaseException)
+        }
+    
     async def cleanup_session(self, session_id: str):
         """Clean up a lead session"""
-        if session_id in self.active_sessions:
-            del self.active_sessions[session_id]
-            print(f"🗑️ Cleaned up Omni session: {session_id}")
+        async with self.active_sessions.lock(session_id):
+            removed = self.active_sessions.pop(session_id)
+        self._evicted.pop(session_id, None)
+        await self._forget_session(session_id)
+        if removed is not None:
+            logger.info("🗑️ Cleaned up Omni session: %s", session_id)
     
     async def reset_all_sessions(self):
         """Reset all Omni agent sessions"""
-        session_count = len(self.active_sessions)
-        self.active_sessions.clear()
-        print(f"🔄 Reset {session_count} Omni agent sessions") 
\ No newline at end of file
+        session_count = await self.active_sessions.clear()
+        await self._forget_all_sessions()
+        logger.info("🔄 Reset %d Omni agent sessions", session_count) 
\ No newline at end of file
@@ -5,20 +5,31 @@ Main application entry point
 """
 
 import os
+import re
 import uuid
-import json
+import queue
+import hashlib
+import asyncio
+import functools
+import time
 import logging
-from typing import Dict, List, Optional, Any
+from logging.handlers import QueueHandler, QueueListener
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Any, Tuple
 from datetime import datetime
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, WebSocket, WebSocketDisconnect
+import aiofiles
+import orjson
+from fastapi import FastAPI, HTTPException, UploadFile, File, Query, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, FileResponse, ORJSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-from backend.agents import CRMAgentManager, OmniAgentManager
+from backend.agents import CRMAgentManager, OmniAgentManager, stage_keys
+from utils.utils import build_ready_state
 from backend.models import (
     ChatMessage, 
     ChatResponse, 
@@ -28,32 +39,71 @@ from backend.models import (
     ApplicationState
 )
 from backend.state_manager import StateManager
+from backend.timestamps import now_iso
 from backend.websocket_manager import WebSocketManager
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging: records are queued and written by a background thread,
+# so request handlers never block on stderr
+_log_queue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+_log_listener = QueueListener(_log_queue, _log_handler, respect_handler_level=True)
+_log_listener.start()
+# The queue handler only merges args into the message; the listener's handler does the formatting
+_queue_handler = QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter("%(message)s"))
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), handlers=[_queue_handler])
 logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run startup and shutdown around the application's lifetime"""
+    await startup_event()
+    yield
+    await shutdown_event()
+
 app = FastAPI(
     title="AI-Powered CRM MVP",
     description="One-night MVP with two Vertex AI agents working together",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    # Encode responses (pipeline payloads, lead lists) with orjson instead of the stdlib json module
+    default_response_class=ORJSONResponse
 )
 
+class _WaitForState:
+    """
+    ASGI middleware that holds requests until persisted state has loaded
+    If loading failed, HTTP requests get a 503 and WebSockets are closed
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket") and scope["path"] != "/ready":
+            await _state_ready.wait()
+            if _state_load_error is not None:
+                if scope["type"] == "http":
+                    response = ORJSONResponse({"detail": "Application state failed to load"}, status_code=503)
+                    await response(scope, receive, send)
+                else:
+                    await send({"type": "websocket.close", "code": 1011})
+                return
+        await self.app(scope, receive, send)
+
+# Added before CORS so CORS wraps it and its 503 responses carry the CORS headers
+app.add_middleware(_WaitForState)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[
-        "http://localhost:3000", 
-        "http://localhost:5173", 
-        "http://localhost:5174",
-        "http://localhost:5175",
-        "http://localhost:8080"
-    ],  # React dev servers
+    # React dev servers on localhost:3000, 5173-5175 and 8080
+    allow_origin_regex=r"http://localhost:(3000|517[345]|8080)",
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -62,28 +112,103 @@ app.add_middleware(
 # Mount static files for the frontend assets
 app.mount("/assets", StaticFiles(directory="frontend/dist/assets"), name="assets")
 
+# Owner uploads are written here, UPLOAD_CHUNK_SIZE bytes at a time
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+UPLOAD_CHUNK_SIZE = 1 << 20
+UPLOAD_ALLOWED_TYPES = frozenset((".pdf", ".docx", ".csv"))
+
+# Encoded /state/* responses, reused while the state version is unchanged
+# and for at most STATE_RESPONSE_TTL seconds: name -> (version, cached_at, body)
+STATE_RESPONSE_TTL = 0.5
+_state_responses: Dict[str, Tuple[int, float, bytes]] = {}
+
+# Fenced ```json blocks in an agent response
+_JSON_BLOCK_RE = re.compile(r"```json\n([\s\S]*?)\n```")
+
+# Flattened stage name keys in a ready state: stage_<N>_stage_name
+_STAGE_NAME_KEY_RE = re.compile(r"stage_(\d+)_stage_name")
+
+# At most this many sessions are checked at once by /admin/trigger-pipeline-complete
+PIPELINE_CHECK_CONCURRENCY = 8
+
+def _count_stages(ready_state: Dict[str, Any]) -> int:
+    """Highest stage number present in a flattened ready state"""
+    return max(
+        (int(m.group(1)) for m in map(_STAGE_NAME_KEY_RE.fullmatch, ready_state) if m),
+        default=0
+    )
+
+# Owner chat turns in flight, keyed by (session_id, digest of message text and files)
+_owner_turns_inflight: Dict[Tuple[str, bytes], asyncio.Future] = {}
+
+def _owner_turn_done(key: Tuple[str, bytes], turn: asyncio.Future):
+    """Forget a finished owner turn"""
+    _owner_turns_inflight.pop(key, None)
+    # Every caller may have disconnected; retrieve the error so it is not reported as unhandled
+    if not turn.cancelled():
+        turn.exception()
+
 # Initialize managers
 crm_agent = CRMAgentManager()
 omni_agent = OmniAgentManager()
-state_manager = StateManager()
 websocket_manager = WebSocketManager()
+# Kanban card changes are pushed to clients as they happen
+state_manager = StateManager(on_card_change=websocket_manager.broadcast_kanban_card)
+
+# Set once loading persisted state has finished, successfully or not;
+# requests other than /ready wait for it
+_state_ready = asyncio.Event()
+_state_loader: Optional[asyncio.Task] = None
+_state_load_error: Optional[Exception] = None
+
+async def _load_state():
+    """Load persisted state, then start journaling and let requests through"""
+    global _state_load_error
+    try:
+        await state_manager.load_state()
+        state_manager.start_journal()
+        state_manager.start_auto_save()
+    except Exception as e:
+        _state_load_error = e
+        logger.exception("❌ Could not load application state")
+    finally:
+        _state_ready.set()
 
-@app.on_event("startup")
 async def startup_event():
     """Initialize application state on startup"""
-    print("🚀 Starting AI-Powered CRM MVP Backend...")
+    logger.info("🚀 Starting AI-Powered CRM MVP Backend...")
+    
+    global _state_loader
     
-    # Load persisted state if it exists
-    await state_manager.load_state()
+    # Load persisted state in the background so the server can bind right away
+    _state_loader = asyncio.create_task(_load_state())
     
-    print("✅ Backend initialized successfully!")
+    # Make sure the upload directory exists before the first upload
+    await asyncio.to_thread(os.makedirs, UPLOAD_DIR, exist_ok=True)
+    
+    # Expire idle agent sessions from the local cache in the background
+    crm_agent.start_reaper()
+    omni_agent.start_reaper()
+    
+    logger.info("🔁 Event loop: %s", type(asyncio.get_running_loop()).__module__)
+    logger.info("✅ Backend initialized successfully!")
 
-@app.on_event("shutdown")
 async def shutdown_event():
     """Save state on shutdown"""
-    print("💾 Saving application state...")
-    await state_manager.save_state()
-    print("👋 Backend shutting down...")
+    crm_agent.stop_reaper()
+    omni_agent.stop_reaper()
+    # Never save over the state file before it has been read, or if it could not be
+    if _state_loader is not None:
+        await _state_loader
+    state_manager.stop_auto_save()
+    if _state_load_error is None:
+        logger.info("💾 Saving application state...")
+        await state_manager.save_state()
+    await state_manager.stop_journal()
+    logger.info("👋 Backend shutting down...")
+    
+    # Flush queued log records
+    _log_listener.stop()
 
 # Health check endpoint (commented out for production deployment)
 # @app.get("/")
@@ -95,6 +220,15 @@ async def shutdown_event():
 #         "timestamp": datetime.now().isoformat()
 #     }
 
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 503 until persisted state has loaded, or if loading it failed"""
+    if not _state_ready.is_set():
+        raise HTTPException(status_code=503, detail="Loading application state")
+    if _state_load_error is not None:
+        raise HTTPException(status_code=503, detail="Application state failed to load")
+    return {"status": "ready"}
+
 @app.post("/test/chat")
 async def test_chat(message: ChatMessage) -> ChatResponse:
     """Test chat endpoint without calling actual agents - for debugging"""
@@ -103,30 +237,172 @@ async def test_chat(message: ChatMessage) -> ChatResponse:
         session_id=message.session_id or "test-session",
         pipeline_complete=False,
         pipeline_payload=None,
-        timestamp=datetime.now().isoformat()
+        timestamp=now_iso()
     )
 
-@app.post("/test/chat")
-async def test_chat_without_agents(message: ChatMessage):
-    """Test endpoint that doesn't call real agents - for debugging without rate limits"""
+# Owner Chat Endpoints (Phase 1)
+async def _start_owner_turn(message: ChatMessage) -> Dict[str, Any]:
+    """Get or create the owner's CRM session and attach any uploaded files"""
+    session = await crm_agent.get_or_create_session(message.session_id)
+    
+    # Handle file uploads if present as one batch: one corpus import and one
+    # session state patch, so concurrent patches cannot overwrite each other's
+    # uploaded_docs. A failed upload does not abort the turn
+    if message.files:
+        try:
+            await crm_agent.handle_file_uploads(session["session_id"], message.files)
+        except Exception as e:
+            logger.error(
+                "❌ Upload of %s failed: %s",
+                ", ".join(file_info["name"] for file_info in message.files),
+                e
+            )
+    
+    return session
+
+def _sse(data: Any, event: Optional[str] = None) -> bytes:
+    """Encode one Server-Sent Events frame"""
+    payload = orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS)
+    if event:
+        return b"event: " + event.encode() + b"\ndata: " + payload + b"\n\n"
+    return b"data: " + payload + b"\n\n"
+
+def _owner_chat_error(e: Exception) -> HTTPException:
+    """Map an owner chat failure to an HTTP error"""
+    if isinstance(e, asyncio.TimeoutError):
+        logger.error("❌ Owner chat error: agent timed out")
+        return HTTPException(status_code=504, detail="The agent took too long to respond. Please try again.")
+    
+    error_msg = str(e)
+    logger.error("❌ Owner chat error: %s", error_msg)
+    
+    # Handle specific error types with appropriate HTTP status codes
+    if "429" in error_msg or "RATE_LIMIT_EXCEEDED" in error_msg:
+        return HTTPException(
+            status_code=429, 
+            detail="Rate limit exceeded. Please wait a minute before sending another message."
+        )
+    elif "quota exceeded" in error_msg.lower():
+        return HTTPException(
+            status_code=429,
+            detail="Google Cloud quota exceeded. Please wait before making more requests."
+        )
+    else:
+        return HTTPException(status_code=500, detail=error_msg)
+
+async def _run_owner_turn(message: ChatMessage) -> ChatResponse:
+    """Run one owner chat turn against the CRM agent"""
+    # Get or create CRM session and attach any uploaded files
+    session = await _start_owner_turn(message)
+    
+    # Send message to CRM agent, keeping only the text of each event
+    text_parts = []
+    async for event in crm_agent.stream_query(
+        session["session_id"], 
+        message.content
+    ):
+        text_parts.extend(crm_agent.event_text_parts(event))
+    
+    # Combine response parts
+    full_response = crm_agent.join_text_parts(text_parts)
+    
+    return await _complete_owner_turn(message, session, full_response)
+
+async def _complete_owner_turn(message: ChatMessage, session: Dict[str, Any], full_response: str) -> ChatResponse:
+    """
+    Finish an owner chat turn once the agent response is in: check pipeline completion,
+    save the ready state and pipeline, store the conversation and build the response
+    """
+    # Get session state once and reuse it (to avoid multiple API calls)
+    raw_session_state = await crm_agent.get_state(session["session_id"])
+    
+    # Check if pipeline is complete using the session state we already have
+    is_complete = await crm_agent.is_pipeline_complete_from_state(raw_session_state)
+    pipeline_payload = None
+    
+    # Always try to extract pipeline payload for debugging (but reuse session state)
     try:
-        print(f"🧪 Test chat message: {message.content}")
-        
-        # Simulate a response without calling real agents
-        test_response = {
-            "response": f"Test response to: {message.content}",
-            "pipeline_complete": False,
-            "pipeline_payload": None,
-            "has_payload": False
-        }
-        
-        return test_response
-        
+        pipeline_payload = await crm_agent.extract_pipeline_payload_from_state(raw_session_state)
+        logger.debug("🔧 Pipeline payload extracted: %s", pipeline_payload is not None)
     except Exception as e:
-        print(f"❌ Test chat error: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.warning("⚠️ Pipeline extraction error: %s", e)
+    
+    # If pipeline is complete (even if payload extraction fails), save state and unlock UI
+    if is_complete:
+        # Save the current session state for future use
+        ready_state_for_frontend = None
+        try:
+            # Build the flattened ready state with 3-4 stages
+            ready_state = await build_ready_state(raw_session_state, current_stage=1)
+            
+            # Validate stage count (user specified 3-4 stages only)
+            total_stages = ready_state.get('total_stages', 0)
+            if total_stages < 3 or total_stages > 4:
+                logger.warning("⚠️ Pipeline has %s stages, expected 3-4", total_stages)
+                if total_stages == 0:
+                    logger.warning("❌ No stages found, pipeline not ready")
+                else:
+                    logger.info("✅ Proceeding with %s stages", total_stages)
+            
+            # Save the ready state
+            state_manager.save_session_state(ready_state)
+            logger.info("💾 Saved ready state for pipeline: %s", ready_state.get('biz_name', 'Unknown'))
+            logger.info("📊 Ready state has %s stages", total_stages)
+            
+            # Store the ready state to return to frontend
+            ready_state_for_frontend = ready_state
+            
+        except Exception as save_error:
+            logger.warning("⚠️ Error building/saving ready state: %s", save_error)
+        
+        # Update the pipeline in state manager (only if payload exists)
+        if pipeline_payload:
+            await state_manager.update_pipeline(pipeline_payload)
+            
+            # Broadcast pipeline update via WebSocket (queued; slow clients do not hold up the turn)
+            await websocket_manager.broadcast_pipeline_update(pipeline_payload)
+        else:
+            logger.warning("⚠️ Pipeline complete but payload extraction failed - UI will still unlock")
+            
+        # Always use the flattened ready state for the frontend if we have it
+        # The frontend needs the flattened format with stage_1_stage_name, etc.
+        if ready_state_for_frontend:
+            logger.debug("✅ Using flattened ready state as pipeline payload for frontend")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("📊 Ready state keys: %s", list(ready_state_for_frontend.keys()))
+            pipeline_payload = ready_state_for_frontend
+        elif not pipeline_payload:
+            logger.warning("⚠️ No ready state or pipeline payload available")
+    
+    # Store conversation in state
+    await state_manager.add_owner_message(message.content, full_response)
+    
+    # Add completion message to response if pipeline is complete
+    if is_complete:
+        completion_message = "\n\n🎉 Pipeline creation complete! Your custom CRM workflow has been generated and is ready to use."
+        full_response += completion_message
+    
+    # Dump the payload once; the debug log and the response share it
+    if isinstance(pipeline_payload, dict):
+        payload_data = pipeline_payload
+    else:
+        payload_data = pipeline_payload.model_dump() if pipeline_payload else None
+    
+    # Debug: Log what we're returning to frontend
+    if payload_data and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("📤 Returning to frontend - pipeline_complete: %s", is_complete)
+        logger.debug("📤 Payload keys: %s", list(payload_data.keys()))
+        if 'biz_name' in payload_data:
+            logger.debug("📤 Business: %s with %s stages", payload_data.get('biz_name'), payload_data.get('total_stages', 0))
+    
+    return ChatResponse(
+        response=full_response,
+        session_id=session["session_id"],
+        pipeline_complete=is_complete,  # This will be True when pipeline is complete, even if payload extraction fails
+        pipeline_payload=payload_data,
+        timestamp=now_iso()
+    )
 
-# Owner Chat Endpoints (Phase 1)
 @app.post("/owner/chat")
 async def owner_chat(message: ChatMessage) -> ChatResponse:
     """
@@ -134,159 +410,58 @@ async def owner_chat(message: ChatMessage) -> ChatResponse:
     Supports text messages and file uploads to build custom sales pipeline
     """
     try:
-        print(f"📨 Owner chat message: {message.content[:100]}...")
+        logger.info("📨 Owner chat message: %.100s...", message.content)
         
-        # Get or create CRM session
-        session = await crm_agent.get_or_create_session(message.session_id)
+        if not message.session_id:
+            return await _run_owner_turn(message)
         
-        # Handle file uploads if present
+        # A double-submitted message (same text and attachments) joins the turn already running for it
+        digest = hashlib.blake2b(message.content.encode(), digest_size=8)
         if message.files:
-            for file_info in message.files:
-                await crm_agent.handle_file_upload(
-                    session["session_id"], 
-                    file_info["path"], 
-                    file_info["name"]
-                )
-        
-        # Send message to CRM agent and stream response
-        response_parts = []
-        async for event in crm_agent.stream_query(
-            session["session_id"], 
-            message.content
-        ):
-            response_parts.append(event)
-        
-        # Combine response parts
-        full_response = crm_agent.combine_response_parts(response_parts)
-        
-        # Get session state once and reuse it (to avoid multiple API calls)
-        engine = session["engine"]
-        remote_session = engine.get_session(
-            user_id=session["user_id"],
-            session_id=session["session_id"]
-        )
-        raw_session_state = remote_session.get('state', {})
+            digest.update(b"\0" + orjson.dumps(message.files, option=orjson.OPT_SORT_KEYS))
+        key = (message.session_id, digest.digest())
+        turn = _owner_turns_inflight.get(key)
+        if turn is None:
+            turn = asyncio.ensure_future(_run_owner_turn(message))
+            _owner_turns_inflight[key] = turn
+            turn.add_done_callback(functools.partial(_owner_turn_done, key))
+        else:
+            logger.info("🔁 Joining in-flight owner turn for session %s", message.session_id)
         
-        # Check if pipeline is complete using the session state we already have
-        is_complete = await crm_agent.is_pipeline_complete_from_state(raw_session_state)
-        pipeline_payload = None
+        # Shield so a disconnecting caller does not cancel the turn for the other
+        return await asyncio.shield(turn)
         
-        # Always try to extract pipeline payload for debugging (but reuse session state)
+    except Exception as e:
+        raise _owner_chat_error(e)
+
+@app.post("/owner/chat/stream")
+async def owner_chat_stream(message: ChatMessage) -> StreamingResponse:
+    """
+    Streaming variant of /owner/chat (Server-Sent Events)
+    Forwards each agent event as it arrives, then sends a "complete" event
+    carrying the same ChatResponse that /owner/chat returns
+    """
+    logger.info("📨 Owner chat stream message: %.100s...", message.content)
+    
+    async def event_stream():
         try:
-            pipeline_payload = await crm_agent.extract_pipeline_payload_from_state(raw_session_state)
-            print(f"🔧 Pipeline payload extracted: {pipeline_payload is not None}")
-        except Exception as e:
-            print(f"⚠️ Pipeline extraction error: {str(e)}")
-        
-        # If pipeline is complete (even if payload extraction fails), save state and unlock UI
-        if is_complete:
-            # Save the current session state for future use
-            ready_state_for_frontend = None
-            try:
-                # Import and use build_ready_state to create the proper flattened state
-                import sys
-                import os
-                import importlib.util
-                
-                # Direct import from utils.py file
-                utils_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'utils', 'utils.py')
-                spec = importlib.util.spec_from_file_location("utils", utils_path)
-                utils_module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(utils_module)
-                build_ready_state = utils_module.build_ready_state
-                
-                print("✅ Successfully imported build_ready_state")
-                
-                # Build the ready state with 3-4 stages
-                ready_state = await build_ready_state(raw_session_state, current_stage=1)
-                
-                # Validate stage count (user specified 3-4 stages only)
-                total_stages = ready_state.get('total_stages', 0)
-                if total_stages < 3 or total_stages > 4:
-                    print(f"⚠️ Pipeline has {total_stages} stages, expected 3-4")
-                    if total_stages == 0:
-                        print("❌ No stages found, pipeline not ready")
-                    else:
-                        print(f"✅ Proceeding with {total_stages} stages")
-                
-                # Save the ready state
-                state_manager.save_session_state(ready_state)
-                print(f"💾 Saved ready state for pipeline: {ready_state.get('biz_name', 'Unknown')}")
-                print(f"📊 Ready state has {total_stages} stages")
-                
-                # Store the ready state to return to frontend
-                ready_state_for_frontend = ready_state
-                
-            except Exception as save_error:
-                print(f"⚠️ Error building/saving ready state: {str(save_error)}")
+            session = await _start_owner_turn(message)
             
-            # Update the pipeline in state manager (only if payload exists)
-            if pipeline_payload:
-                await state_manager.update_pipeline(pipeline_payload)
-                
-                # Broadcast pipeline update via WebSocket
-                await websocket_manager.broadcast_pipeline_update(pipeline_payload)
-            else:
-                print("⚠️ Pipeline complete but payload extraction failed - UI will still unlock")
-                
-            # Always use the flattened ready state for the frontend if we have it
-            # The frontend needs the flattened format with stage_1_stage_name, etc.
-            if ready_state_for_frontend:
-                print("✅ Using flattened ready state as pipeline payload for frontend")
-                print(f"📊 Ready state keys: {list(ready_state_for_frontend.keys())}")
-                # Create a simple object that returns the ready_state when model_dump() is called
-                class ReadyStatePayload:
-                    def __init__(self, ready_state):
-                        self.ready_state = ready_state
-                    
-                    def model_dump(self):
-                        return self.ready_state
-                
-                pipeline_payload = ReadyStatePayload(ready_state_for_frontend)
-            elif not pipeline_payload:
-                print("⚠️ No ready state or pipeline payload available")
-        
-        # Store conversation in state
-        await state_manager.add_owner_message(message.content, full_response)
-        
-        # Add completion message to response if pipeline is complete
-        if is_complete:
-            completion_message = "\n\n🎉 Pipeline creation complete! Your custom CRM workflow has been generated and is ready to use."
-            full_response += completion_message
-        
-        # Debug: Log what we're returning to frontend
-        if pipeline_payload:
-            payload_data = pipeline_payload.model_dump() if hasattr(pipeline_payload, 'model_dump') else pipeline_payload
-            print(f"📤 Returning to frontend - pipeline_complete: {is_complete}")
-            print(f"📤 Payload keys: {list(payload_data.keys()) if isinstance(payload_data, dict) else 'Not a dict'}")
-            if isinstance(payload_data, dict) and 'biz_name' in payload_data:
-                print(f"📤 Business: {payload_data.get('biz_name')} with {payload_data.get('total_stages', 0)} stages")
-        
-        return ChatResponse(
-            response=full_response,
-            session_id=session["session_id"],
-            pipeline_complete=is_complete,  # This will be True when pipeline is complete, even if payload extraction fails
-            pipeline_payload=pipeline_payload.model_dump() if pipeline_payload else None,
-            timestamp=datetime.now().isoformat()
-        )
-        
-    except Exception as e:
-        error_msg = str(e)
-        print(f"❌ Owner chat error: {error_msg}")
-        
-        # Handle specific error types with appropriate HTTP status codes
-        if "429" in error_msg or "RATE_LIMIT_EXCEEDED" in error_msg:
-            raise HTTPException(
-                status_code=429, 
-                detail="Rate limit exceeded. Please wait a minute before sending another message."
-            )
-        elif "quota exceeded" in error_msg.lower():
-            raise HTTPException(
-                status_code=429,
-                detail="Google Cloud quota exceeded. Please wait before making more requests."
-            )
-        else:
-            raise HTTPException(status_code=500, detail=error_msg)
+            # Forward events as they arrive, keeping only their text for the final response
+            text_parts = []
+            async for event in crm_agent.stream_query(session["session_id"], message.content):
+                text_parts.extend(crm_agent.event_text_parts(event))
+                yield _sse(event)
+            
+            full_response = crm_agent.join_text_parts(text_parts)
+            chat_response = await _complete_owner_turn(message, session, full_response)
+            yield _sse(chat_response.model_dump(), "complete")
+            
+        except Exception as e:
+            error = _owner_chat_error(e)
+            yield _sse({"status_code": error.status_code, "detail": error.detail}, "error")
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 @app.post("/owner/upload")
 async def upload_file(file: UploadFile = File(...), session_id: Optional[str] = None):
@@ -296,39 +471,64 @@ async def upload_file(file: UploadFile = File(...), session_id: Optional[str] =
     """
     try:
         # Validate file type
-        allowed_types = ['.pdf', '.docx', '.csv']
-        file_ext = os.path.splitext(file.filename)[1].lower()
+        file_ext = "." + file.filename.rpartition(".")[2].lower()
         
-        if file_ext not in allowed_types:
+        if file_ext not in UPLOAD_ALLOWED_TYPES:
             raise HTTPException(
                 status_code=400, 
-                detail=f"File type {file_ext} not supported. Allowed: {allowed_types}"
+                detail=f"File type {file_ext} not supported. Allowed: {sorted(UPLOAD_ALLOWED_TYPES)}"
             )
         
-        # Save file temporarily
-        upload_dir = "uploads"
-        os.makedirs(upload_dir, exist_ok=True)
+        # Stream the file to disk in chunks, hashing it as it goes
+        tmp_path = os.path.join(UPLOAD_DIR, f".{uuid.uuid4().hex}.part")
+        digest = hashlib.blake2b(digest_size=16)
         
-        file_path = f"{upload_dir}/{uuid.uuid4().hex}_{file.filename}"
-        
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        print(f"📁 File uploaded: {file.filename} -> {file_path}")
+        size = 0
+        try:
+            async with aiofiles.open(tmp_path, "wb") as buffer:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    digest.update(chunk)
+                    await buffer.write(chunk)
+                    size += len(chunk)
+            
+            # Name the file by its content so re-uploads map to the same path
+            file_path = os.path.join(UPLOAD_DIR, f"{digest.hexdigest()}_{os.path.basename(file.filename)}")
+            if await asyncio.to_thread(os.path.exists, file_path):
+                await asyncio.to_thread(os.remove, tmp_path)
+                logger.info("📁 File already uploaded: %s -> %s", file.filename, file_path)
+            else:
+                await asyncio.to_thread(os.replace, tmp_path, file_path)
+                logger.info("📁 File uploaded: %s -> %s", file.filename, file_path)
+        except BaseException:
+            if await asyncio.to_thread(os.path.exists, tmp_path):
+                await asyncio.to_thread(os.remove, tmp_path)
+            raise
         
         return {
             "filename": file.filename,
             "path": file_path,
-            "size": len(content),
+            "size": size,
             "type": file_ext
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"❌ File upload error: {str(e)}")
+        logger.error("❌ File upload error: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 # State Management Endpoints
+def _cached_state_response(name: str, content: Any) -> Response:
+    """Encode a /state/* payload once and reuse the bytes until the state changes"""
+    now = time.monotonic()
+    cached = _state_responses.get(name)
+    if cached and cached[0] == state_manager.version and now - cached[1] < STATE_RESPONSE_TTL:
+        body = cached[2]
+    else:
+        body = ORJSONResponse(jsonable_encoder(content)).body
+        _state_responses[name] = (state_manager.version, now, body)
+    return Response(content=body, media_type="application/json")
+
 @app.get("/state/pipeline")
 async def get_pipeline_state():
     """Get the current pipeline state for the frontend"""
@@ -337,14 +537,16 @@ async def get_pipeline_state():
         ready_state = await state_manager.get_ready_state()
         
         if ready_state and ready_state.get('pipeline_completed'):
-            print(f"📊 Returning pipeline state: {ready_state.get('biz_name')} with {ready_state.get('total_stages')} stages")
-            return ready_state
+            logger.debug("📊 Returning pipeline state: %s with %s stages", ready_state.get('biz_name'), ready_state.get('total_stages'))
+            return _cached_state_response("pipeline", ready_state)
         else:
-            print("⚠️ No completed pipeline found in ready state")
+            logger.debug("⚠️ No completed pipeline found in ready state")
             raise HTTPException(status_code=404, detail="No pipeline data available")
             
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"❌ Error getting pipeline state: {str(e)}")
+        logger.error("❌ Error getting pipeline state: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/state/leads")
@@ -354,35 +556,44 @@ async def get_leads_state():
         # Get leads from state manager
         leads_data = await state_manager.get_leads()
         
-        print(f"📊 Returning {len(leads_data)} leads for KanbanBoard")
-        return leads_data
+        logger.debug("📊 Returning %d leads for KanbanBoard", len(leads_data))
+        return _cached_state_response("leads", leads_data)
         
     except Exception as e:
-        print(f"❌ Error getting leads state: {str(e)}")
+        logger.error("❌ Error getting leads state: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/state/business")
 async def get_business_data():
     """Get business configuration data"""
-    return await state_manager.get_business_data()
+    return _cached_state_response("business", await state_manager.get_business_data())
 
 # WebSocket endpoint for real-time updates
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
     """WebSocket connection for real-time updates"""
     await websocket_manager.connect(websocket, client_id)
+    # Later updates arrive as single card changes, so start the client from the full board
+    await websocket_manager.send_kanban_board(client_id, state_manager.state.kanban_board)
     
     try:
         while True:
             # Keep connection alive and listen for messages
-            data = await websocket.receive_text()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
             
-            # Echo back for now (can be extended for bidirectional communication)
-            await websocket.send_text(f"Echo: {data}")
+            # Echo back for now (can be extended for bidirectional communication).
+            # Replies go through the client's outbox so they never race its sender task,
+            # and binary frames are echoed as bytes without a decode/encode round trip
+            if message.get("bytes") is not None:
+                websocket_manager.send_frame(client_id, b"Echo: " + message["bytes"])
+            else:
+                websocket_manager.send_frame(client_id, "Echo: " + message["text"])
             
     except WebSocketDisconnect:
         websocket_manager.disconnect(client_id)
-        print(f"🔌 WebSocket disconnected: {client_id}")
+        logger.info("🔌 WebSocket disconnected: %s", client_id)
 
 # Lead Chat Endpoints (Phase 3)
 @app.post("/lead/create")
@@ -412,14 +623,10 @@ async def create_lead_session(lead_id: Optional[str] = None):
         # Build the ready state for Omni agent - session state is already flattened
         ready_state = dict(session_state)
         
-        # Ensure we have the total_stages set correctly
-        if 'total_stages' not in ready_state or ready_state['total_stages'] == 0:
-            # Count stages by looking for stage_N_stage_name fields
-            stage_count = 0
-            for i in range(1, 10):  # Check up to 9 stages
-                if f'stage_{i}_stage_name' in ready_state:
-                    stage_count = i
-            ready_state['total_stages'] = stage_count
+        # Ensure we have the total_stages set correctly (build_ready_state sets it,
+        # but states saved by older versions may not have it)
+        if not ready_state.get('total_stages'):
+            ready_state['total_stages'] = _count_stages(ready_state)
         
         # Ensure current stage info is populated
         if 'current_stage_name' not in ready_state or not ready_state['current_stage_name']:
@@ -446,9 +653,48 @@ async def create_lead_session(lead_id: Optional[str] = None):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error creating lead session: {str(e)}")
+        logger.error("Error creating lead session: %s", e)
         raise HTTPException(status_code=500, detail=f"Error creating lead session: {str(e)}")
 
+async def _check_lead_session(message: ChatMessage):
+    """Reject lead chat turns for sessions that do not exist"""
+    if not message.session_id or await omni_agent.get_session(message.session_id) is None:
+        raise HTTPException(status_code=404, detail="Lead session not found. Create a session first.")
+
+def _lead_chat_error(e: Exception) -> HTTPException:
+    """Map a lead chat failure to an HTTP error"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, asyncio.TimeoutError):
+        logger.error("Lead chat error: agent timed out")
+        return HTTPException(status_code=504, detail="The agent took too long to respond. Please try again.")
+    logger.error("Lead chat error: %s", e)
+    return HTTPException(status_code=500, detail=str(e))
+
+async def _complete_lead_turn(message: ChatMessage, full_response: str) -> ChatResponse:
+    """Sync lead data and store the conversation once the agent has answered"""
+    # Always check for updated lead data after conversation
+    updated_lead_data = await omni_agent.get_lead_data(message.session_id)
+    
+    # If we have lead data, update the state manager
+    if updated_lead_data:
+        # Convert to LeadData model and update state manager
+        lead_model = LeadData(**updated_lead_data)
+        await state_manager.add_lead(lead_model)
+        
+        logger.info("📊 Lead data synchronized: %s -> Stage %s", updated_lead_data.get('name', 'Unknown'), updated_lead_data.get('stage', 1))
+    
+    # Store conversation
+    await state_manager.add_lead_message(message.session_id, message.content, full_response)
+    
+    return ChatResponse(
+        response=full_response,
+        session_id=message.session_id,
+        pipeline_complete=False,  # Not applicable for lead chat
+        pipeline_payload=updated_lead_data,  # Return updated lead data
+        timestamp=now_iso()
+    )
+
 @app.post("/lead/chat")
 async def lead_chat(message: ChatMessage) -> ChatResponse:
     """
@@ -456,53 +702,58 @@ async def lead_chat(message: ChatMessage) -> ChatResponse:
     Tracks state changes and updates lead data automatically
     """
     try:
-        print(f"📨 Lead chat message: {message.content[:100]}...")
-        
-        # Check if session exists
-        if not message.session_id or message.session_id not in omni_agent.active_sessions:
-            raise HTTPException(status_code=404, detail="Lead session not found. Create a session first.")
-        
-        # Send message to Omni agent and stream response
-        response_parts = []
-        state_changes_detected = False
+        logger.info("📨 Lead chat message: %.100s...", message.content)
+        await _check_lead_session(message)
         
+        # Send message to Omni agent, keeping only the text of each event
+        # (stream_query itself tracks state-changing tool calls)
+        text_parts = []
         async for event in omni_agent.stream_query(message.session_id, message.content):
-            response_parts.append(event)
-            
-            # Check if this event indicates state changes
-            if omni_agent._is_state_change_event(event):
-                state_changes_detected = True
+            text_parts.extend(omni_agent.event_text_parts(event))
         
         # Combine response parts
-        full_response = omni_agent.combine_response_parts(response_parts)
-        
-        # Always check for updated lead data after conversation
-        updated_lead_data = await omni_agent.get_lead_data(message.session_id)
+        full_response = omni_agent.join_text_parts(text_parts)
+        return await _complete_lead_turn(message, full_response)
         
-        # If we have lead data, update the state manager
-        if updated_lead_data:
-            # Convert to LeadData model and update state manager
-            from backend.models import LeadData
-            lead_model = LeadData(**updated_lead_data)
-            await state_manager.add_lead(lead_model)
+    except Exception as e:
+        raise _lead_chat_error(e)
+
+@app.post("/lead/chat/stream")
+async def lead_chat_stream(message: ChatMessage) -> StreamingResponse:
+    """
+    Streaming variant of /lead/chat (Server-Sent Events)
+    Forwards each agent event as it arrives, then sends a "complete" event
+    carrying the same ChatResponse that /lead/chat returns
+    """
+    logger.info("📨 Lead chat stream message: %.100s...", message.content)
+    # Unknown sessions still get a plain 404 rather than an event stream
+    await _check_lead_session(message)
+    
+    async def event_stream():
+        try:
+            text_parts = []
+            async for event in omni_agent.stream_query(message.session_id, message.content):
+                text_parts.extend(omni_agent.event_text_parts(event))
+                yield _sse(event)
             
-            print(f"📊 Lead data synchronized: {updated_lead_data.get('name', 'Unknown')} -> Stage {updated_lead_data.get('stage', 1)}")
-        
-        # Store conversation
-        await state_manager.add_lead_message(message.session_id, message.content, full_response)
-        
-        return ChatResponse(
-            response=full_response,
-            session_id=message.session_id,
-            pipeline_complete=False,  # Not applicable for lead chat
-            pipeline_payload=updated_lead_data,  # Return updated lead data
-            timestamp=datetime.now().isoformat()
-        )
+            full_response = omni_agent.join_text_parts(text_parts)
+            chat_response = await _complete_lead_turn(message, full_response)
+            yield _sse(chat_response.model_dump(), "complete")
+            
+        except Exception as e:
+            error = _lead_chat_error(e)
+            yield _sse({"status_code": error.status_code, "detail": error.detail}, "error")
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.get("/lead/data")
+async def get_lead_data_many(session_ids: List[str] = Query(...)):
+    """Get current lead data for several Omni sessions in one request"""
+    try:
+        return await omni_agent.get_lead_data_many(session_ids)
         
-    except HTTPException:
-        raise
     except Exception as e:
-        logger.error(f"Lead chat error: {str(e)}")
+        logger.error("Error getting lead data: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/lead/data/{session_id}")
@@ -519,7 +770,7 @@ async def get_lead_data(session_id: str):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error getting lead data: {str(e)}")
+        logger.error("Error getting lead data: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 # Manual Pipeline Activation (MVP Fix)
@@ -557,13 +808,13 @@ async def activate_pipeline_manually():
             "message": "Pipeline activated manually",
             "business_name": session_state.get('biz_name'),
             "total_stages": session_state.get('total_stages'),
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now()
         }
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error activating pipeline manually: {str(e)}")
+        logger.error("Error activating pipeline manually: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/admin/extract-from-conversation")
@@ -573,7 +824,7 @@ async def extract_from_conversation():
     This handles cases where the CRM agent created a pipeline but it wasn't saved to session_state
     """
     try:
-        print("🔄 Extracting pipeline data from conversation history...")
+        logger.info("🔄 Extracting pipeline data from conversation history...")
         
         # Get the current state with conversations
         current_state = state_manager.state
@@ -582,7 +833,7 @@ async def extract_from_conversation():
         if not conversations:
             return {"message": "No conversations found", "success": False}
         
-        print(f"📋 Found {len(conversations)} conversations")
+        logger.debug("📋 Found %s conversations", len(conversations))
         
         # Look for the last conversation that contains pipeline structure
         pipeline_response = None
@@ -592,46 +843,46 @@ async def extract_from_conversation():
             "goal": ""
         }
         
-        # Extract business info from conversations
-        for conv in conversations:
-            if "Lexora Legal Services" in conv.get("message", ""):
-                business_info["biz_name"] = "Lexora Legal Services"
-            elif "boutique law firm" in conv.get("response", ""):
-                # Extract biz_info from response
-                response = conv.get("response", "")
-                if "boutique law firm" in response:
-                    business_info["biz_info"] = "Boutique law firm based in Mexico City specializing in corporate law, intellectual property, and legal compliance for startups and SMEs"
-            elif "CRM is designed" in conv.get("message", ""):
-                business_info["goal"] = conv.get("message", "").strip()
-        
-        # Look for the pipeline structure in the last response
+        # Walk the history once, newest first, so the latest match for each
+        # field wins; stop as soon as everything has been found
         for conv in reversed(conversations):
+            message = conv.get("message", "")
             response = conv.get("response", "")
-            if "stage_number" in response and "stage_name" in response:
+            
+            if pipeline_response is None and "stage_number" in response and "stage_name" in response:
                 pipeline_response = response
+            
+            # Business info from conversations
+            if "Lexora Legal Services" in message:
+                if not business_info["biz_name"]:
+                    business_info["biz_name"] = "Lexora Legal Services"
+            elif "boutique law firm" in response:
+                if not business_info["biz_info"]:
+                    business_info["biz_info"] = "Boutique law firm based in Mexico City specializing in corporate law, intellectual property, and legal compliance for startups and SMEs"
+            elif "CRM is designed" in message:
+                if not business_info["goal"]:
+                    business_info["goal"] = message.strip()
+            
+            if pipeline_response is not None and all(business_info.values()):
                 break
         
         if not pipeline_response:
             return {"message": "No pipeline structure found in conversations", "success": False}
         
-        print("✅ Found pipeline structure in conversation")
+        logger.debug("✅ Found pipeline structure in conversation")
         
-        # Parse the JSON structure from the response
-        import json
-        import re
-        
-        # Extract JSON blocks from the response
-        json_blocks = re.findall(r'```json\n(.*?)\n```', pipeline_response, re.DOTALL)
+        # Extract the JSON blocks from the response
+        json_blocks = _JSON_BLOCK_RE.findall(pipeline_response)
         
         if len(json_blocks) < 3:
             return {"message": "Incomplete pipeline structure found", "success": False}
         
         # Parse the blocks
-        stages_basic = json.loads(json_blocks[0])  # Basic stage info
-        stages_prompts = json.loads(json_blocks[1])  # Stage prompts
-        stages_fields = json.loads(json_blocks[2])  # Stage fields
+        stages_basic = orjson.loads(json_blocks[0])  # Basic stage info
+        stages_prompts = orjson.loads(json_blocks[1])  # Stage prompts
+        stages_fields = orjson.loads(json_blocks[2])  # Stage fields
         
-        print(f"📊 Parsed {len(stages_basic)} stages")
+        logger.debug("📊 Parsed %s stages", len(stages_basic))
         
         # Build the ready state manually
         ready_state = {
@@ -648,21 +899,26 @@ async def extract_from_conversation():
             "kb_files": []
         }
         
-        # Add flattened stage data
+        # Add flattened stage data, using the precomputed stage_{i}_{field} keys
         for i, stage in enumerate(stages_basic, 1):
-            ready_state[f"stage_{i}_stage_name"] = stage["stage_name"]
-            ready_state[f"stage_{i}_stage_number"] = i
-            ready_state[f"stage_{i}_entry_condition"] = stage["entry_condition"]
-            ready_state[f"stage_{i}_brief_stage_goal"] = stage["brief_stage_goal"]
+            keys = stage_keys(i)
+            stage_data = {
+                keys["stage_name"]: stage["stage_name"],
+                keys["stage_number"]: i,
+                keys["entry_condition"]: stage["entry_condition"],
+                keys["brief_stage_goal"]: stage["brief_stage_goal"]
+            }
             
             # Add prompt from prompts array
             if i <= len(stages_prompts):
-                ready_state[f"stage_{i}_prompt"] = stages_prompts[i-1]["prompt"]
+                stage_data[keys["prompt"]] = stages_prompts[i-1]["prompt"]
             
             # Add fields from fields array
             if i <= len(stages_fields):
-                ready_state[f"stage_{i}_fields"] = stages_fields[i-1]["fields"]
-                ready_state[f"stage_{i}_user_tags"] = stages_fields[i-1]["user_tags"]
+                stage_data[keys["fields"]] = stages_fields[i-1]["fields"]
+                stage_data[keys["user_tags"]] = stages_fields[i-1]["user_tags"]
+            
+            ready_state.update(stage_data)
         
         # Add current stage info
         ready_state["current_stage_name"] = ready_state["stage_1_stage_name"]
@@ -671,19 +927,19 @@ async def extract_from_conversation():
         # Save the ready state
         state_manager.save_session_state(ready_state)
         
-        print(f"✅ Extracted and saved ready state for: {ready_state['biz_name']}")
-        print(f"📊 Ready state has {ready_state['total_stages']} stages")
+        logger.info("✅ Extracted and saved ready state for: %s", ready_state['biz_name'])
+        logger.info("📊 Ready state has %s stages", ready_state['total_stages'])
         
         return {
             "message": "Pipeline data extracted from conversation successfully",
             "business_name": ready_state["biz_name"],
             "total_stages": ready_state["total_stages"],
             "success": True,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now()
         }
         
     except Exception as e:
-        logger.error(f"Error extracting from conversation: {str(e)}")
+        logger.error("Error extracting from conversation: %s", e)
         return {
             "message": f"Error extracting from conversation: {str(e)}",
             "success": False
@@ -696,7 +952,7 @@ async def convert_session_state():
     This works around the rate limiting issue by using existing data
     """
     try:
-        print("🔄 Converting existing session state to ready state...")
+        logger.info("🔄 Converting existing session state to ready state...")
         
         # Get the current session state from state manager
         current_session_state = state_manager.get_session_state()
@@ -704,11 +960,11 @@ async def convert_session_state():
         if not current_session_state:
             return {"message": "No session state found", "success": False}
         
-        print(f"📋 Current session state keys: {list(current_session_state.keys())}")
+        logger.debug("📋 Current session state keys: %s", list(current_session_state))
         
         # Check if we already have a ready state (flattened)
         if current_session_state.get('total_stages') and current_session_state.get('stage_1_stage_name'):
-            print("✅ Session state is already a ready state")
+            logger.info("✅ Session state is already a ready state")
             return {
                 "message": "Session state is already a ready state",
                 "business_name": current_session_state.get('biz_name', 'Unknown'),
@@ -716,24 +972,12 @@ async def convert_session_state():
                 "success": True
             }
         
-        # Import and use build_ready_state to convert raw state to ready state
-        import sys
-        import os
-        import importlib.util
-        
-        # Direct import from utils.py file
-        utils_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'utils', 'utils.py')
-        spec = importlib.util.spec_from_file_location("utils", utils_path)
-        utils_module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(utils_module)
-        build_ready_state = utils_module.build_ready_state
-        
-        # Build the ready state
+        # Convert the raw state to a ready state
         ready_state = await build_ready_state(current_session_state, current_stage=1)
         
         # Validate stage count
         total_stages = ready_state.get('total_stages', 0)
-        print(f"📊 Ready state built with {total_stages} stages")
+        logger.debug("📊 Ready state built with %s stages", total_stages)
         
         if total_stages < 3:
             return {
@@ -745,23 +989,72 @@ async def convert_session_state():
         # Save the ready state
         state_manager.save_session_state(ready_state)
         
-        print(f"✅ Converted and saved ready state for: {ready_state.get('biz_name', 'Unknown')}")
+        logger.info("✅ Converted and saved ready state for: %s", ready_state.get('biz_name', 'Unknown'))
         
         return {
             "message": "Session state converted to ready state successfully",
             "business_name": ready_state.get('biz_name', 'Unknown'),
             "total_stages": total_stages,
             "success": True,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now()
         }
         
     except Exception as e:
-        logger.error(f"Error converting session state: {str(e)}")
+        logger.error("Error converting session state: %s", e)
         return {
             "message": f"Error converting session state: {str(e)}",
             "success": False
         }
 
+async def _check_and_activate(session_id: str) -> Dict[str, Any]:
+    """Activate the pipeline of a completed CRM session, returning its status entry"""
+    try:
+        logger.debug("🔍 Checking session %s...", session_id)
+        
+        # Check if pipeline is complete
+        is_complete = await crm_agent.is_pipeline_complete(session_id)
+        logger.debug("📊 Session %s complete: %s", session_id, is_complete)
+        
+        if is_complete:
+            # Extract pipeline payload
+            pipeline_payload = await crm_agent.extract_pipeline_payload(session_id)
+            
+            if pipeline_payload:
+                # Save to state manager
+                await state_manager.update_pipeline(pipeline_payload)
+                
+                # Get the raw session state (served from the short-lived state cache) and build ready state
+                raw_session_state = await crm_agent.get_state(session_id)
+                ready_state = await build_ready_state(raw_session_state, current_stage=1)
+                state_manager.save_session_state(ready_state)
+                
+                logger.info("✅ Pipeline activated for %s", pipeline_payload.biz_name)
+                
+                return {
+                    "session_id": session_id,
+                    "business_name": pipeline_payload.biz_name,
+                    "stages": pipeline_payload.total_stages,
+                    "status": "completed"
+                }
+            else:
+                return {
+                    "session_id": session_id,
+                    "status": "complete_but_no_payload"
+                }
+        else:
+            return {
+                "session_id": session_id,
+                "status": "not_complete"
+            }
+    
+    except Exception as session_error:
+        logger.warning("⚠️ Error processing session %s: %s", session_id, session_error)
+        return {
+            "session_id": session_id,
+            "status": "error",
+            "error": str(session_error)
+        }
+
 @app.post("/admin/trigger-pipeline-complete")
 async def trigger_pipeline_complete():
     """
@@ -769,89 +1062,30 @@ async def trigger_pipeline_complete():
     This is a workaround for rate limiting during development
     """
     try:
-        print("🔄 Manually triggering pipeline completion check...")
+        logger.info("🔄 Manually triggering pipeline completion check...")
         
         # Check all active CRM sessions
         active_sessions = crm_agent.active_sessions
         if not active_sessions:
             return {"message": "No active CRM sessions found", "sessions": 0}
         
-        results = []
-        for session_id, session_data in active_sessions.items():
-            try:
-                print(f"🔍 Checking session {session_id}...")
-                
-                # Check if pipeline is complete
-                is_complete = await crm_agent.is_pipeline_complete(session_id)
-                print(f"📊 Session {session_id} complete: {is_complete}")
-                
-                if is_complete:
-                    # Extract pipeline payload
-                    pipeline_payload = await crm_agent.extract_pipeline_payload(session_id)
-                    
-                    if pipeline_payload:
-                        # Save to state manager
-                        await state_manager.update_pipeline(pipeline_payload)
-                        
-                        # Get the raw session state and build ready state
-                        engine = session_data["engine"]
-                        remote_session = engine.get_session(
-                            user_id=session_data["user_id"],
-                            session_id=session_id
-                        )
-                        raw_session_state = remote_session.get('state', {})
-                        
-                        # Import and use build_ready_state
-                        import sys
-                        import os
-                        import importlib.util
-                        
-                        # Direct import from utils.py file
-                        utils_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'utils', 'utils.py')
-                        spec = importlib.util.spec_from_file_location("utils", utils_path)
-                        utils_module = importlib.util.module_from_spec(spec)
-                        spec.loader.exec_module(utils_module)
-                        build_ready_state = utils_module.build_ready_state
-                        
-                        ready_state = await build_ready_state(raw_session_state, current_stage=1)
-                        state_manager.save_session_state(ready_state)
-                        
-                        results.append({
-                            "session_id": session_id,
-                            "business_name": pipeline_payload.biz_name,
-                            "stages": pipeline_payload.total_stages,
-                            "status": "completed"
-                        })
-                        
-                        print(f"✅ Pipeline activated for {pipeline_payload.biz_name}")
-                    else:
-                        results.append({
-                            "session_id": session_id,
-                            "status": "complete_but_no_payload"
-                        })
-                else:
-                    results.append({
-                        "session_id": session_id,
-                        "status": "not_complete"
-                    })
-                    
-            except Exception as session_error:
-                print(f"⚠️ Error processing session {session_id}: {str(session_error)}")
-                results.append({
-                    "session_id": session_id,
-                    "status": "error",
-                    "error": str(session_error)
-                })
+        limit = asyncio.Semaphore(PIPELINE_CHECK_CONCURRENCY)
+        
+        async def check(session_id: str) -> Dict[str, Any]:
+            async with limit:
+                return await _check_and_activate(session_id)
+        
+        results = await asyncio.gather(*(check(session_id) for session_id in active_sessions.keys()))
         
         return {
             "message": "Pipeline completion check completed",
             "sessions_checked": len(active_sessions),
             "results": results,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now()
         }
         
     except Exception as e:
-        logger.error(f"Error in manual pipeline completion trigger: {str(e)}")
+        logger.error("Error in manual pipeline completion trigger: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/admin/reset-state")
@@ -873,4 +1107,6 @@ async def serve_react_app(catchall: str):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
+    # uvloop and httptools come with uvicorn[standard]. Keep a single worker:
+    # sessions, state and WebSocket clients all live in this process
+    uvicorn.run("backend.main:app", host="0.0.0.0", port=8000, reload=True, loop="uvloop", http="httptools") 
\ No newline at end of file
@@ -4,12 +4,15 @@ Pydantic models for API request/response structures
 """
 
 from typing import Dict, List, Optional, Any, Union
-from datetime import datetime
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
+
+from .timestamps import now_iso
 
 # Chat Models
 class ChatMessage(BaseModel):
     """Chat message from owner or lead"""
+    model_config = ConfigDict(frozen=True)
+
     content: str = Field(..., description="Message content")
     session_id: Optional[str] = Field(None, description="Session ID (auto-generated if not provided)")
     files: Optional[List[Dict[str, str]]] = Field(None, description="Uploaded files info")
@@ -26,6 +29,8 @@ class ChatResponse(BaseModel):
 # Pipeline Models
 class StageConfig(BaseModel):
     """Configuration for a single pipeline stage"""
+    model_config = ConfigDict(frozen=True)
+
     stage_name: str = Field(..., description="Name of the stage")
     stage_number: int = Field(..., description="Stage number (1-based)")
     entry_condition: str = Field(..., description="Condition to enter this stage")
@@ -43,7 +48,7 @@ class PipelinePayload(BaseModel):
     total_stages: int = Field(..., description="Total number of stages")
     stages: List[StageConfig] = Field(..., description="List of stage configurations")
     pipeline_completed: bool = Field(True, description="Pipeline completion status")
-    created_at: str = Field(default_factory=lambda: datetime.now().isoformat())
+    created_at: str = Field(default_factory=now_iso)
 
 # Lead Models
 class LeadData(BaseModel):
@@ -60,8 +65,8 @@ class LeadData(BaseModel):
     stage: int = Field(1, description="Current pipeline stage")
     user_tags: List[str] = Field(default_factory=list, description="Tags assigned to this lead")
     session_id: str = Field(..., description="Lead's session ID")
-    created_at: str = Field(default_factory=lambda: datetime.now().isoformat())
-    updated_at: str = Field(default_factory=lambda: datetime.now().isoformat())
+    created_at: str = Field(default_factory=now_iso)
+    updated_at: str = Field(default_factory=now_iso)
 
 # Business Models
 class BusinessData(BaseModel):
@@ -71,8 +76,8 @@ class BusinessData(BaseModel):
     goal: str = Field("", description="Business goal")
     business_id: str = Field("", description="Unique business identifier")
     owner_session_id: Optional[str] = Field(None, description="Owner's session ID")
-    created_at: str = Field(default_factory=lambda: datetime.now().isoformat())
-    updated_at: str = Field(default_factory=lambda: datetime.now().isoformat())
+    created_at: str = Field(default_factory=now_iso)
+    updated_at: str = Field(default_factory=now_iso)
 
 # Kanban Models
 class KanbanCard(BaseModel):
@@ -83,7 +88,7 @@ class KanbanCard(BaseModel):
     user_tags: List[str] = Field(default_factory=list, description="Lead tags")
     stage: int = Field(..., description="Current stage")
     position: int = Field(0, description="Position within stage")
-    updated_at: str = Field(default_factory=lambda: datetime.now().isoformat())
+    updated_at: str = Field(default_factory=now_iso)
 
 class KanbanColumn(BaseModel):
     """Kanban column representing a pipeline stage"""
@@ -97,23 +102,27 @@ class KanbanBoard(BaseModel):
     business_name: str = Field("", description="Business name")
     columns: List[KanbanColumn] = Field(default_factory=list, description="Board columns")
     total_leads: int = Field(0, description="Total number of leads")
-    updated_at: str = Field(default_factory=lambda: datetime.now().isoformat())
+    updated_at: str = Field(default_factory=now_iso)
 
 # WebSocket Models
 class WebSocketMessage(BaseModel):
     """WebSocket message structure"""
+    model_config = ConfigDict(frozen=True)
+
     type: str = Field(..., description="Message type")
     data: Dict[str, Any] = Field(..., description="Message data")
-    timestamp: str = Field(default_factory=lambda: datetime.now().isoformat())
+    timestamp: str = Field(default_factory=now_iso)
 
 # File Upload Models
 class FileUpload(BaseModel):
     """File upload information"""
+    model_config = ConfigDict(frozen=True)
+
     filename: str = Field(..., description="Original filename")
     path: str = Field(..., description="Server file path")
     size: int = Field(..., description="File size in bytes")
     type: str = Field(..., description="File type/extension")
-    uploaded_at: str = Field(default_factory=lambda: datetime.now().isoformat())
+    uploaded_at: str = Field(default_factory=now_iso)
 
 # State Models
 class ApplicationState(BaseModel):
@@ -126,7 +135,7 @@ class ApplicationState(BaseModel):
     active_sessions: Dict[str, Dict[str, Any]] = Field(default_factory=dict)
     kanban_board: KanbanBoard = Field(default_factory=KanbanBoard)
     session_state: Dict[str, Any] = Field(default_factory=dict, description="Complete session state for ready state preparation")
-    last_updated: str = Field(default_factory=lambda: datetime.now().isoformat())
+    last_updated: str = Field(default_factory=now_iso)
 
 # API Response Models
 class APIResponse(BaseModel):
@@ -134,11 +143,11 @@ class APIResponse(BaseModel):
     success: bool = Field(True, description="Operation success status")
     message: str = Field("", description="Response message")
     data: Optional[Any] = Field(None, description="Response data")
-    timestamp: str = Field(default_factory=lambda: datetime.now().isoformat())
+    timestamp: str = Field(default_factory=now_iso)
 
 class ErrorResponse(BaseModel):
     """Error response model"""
     success: bool = Field(False, description="Always false for errors")
     error: str = Field(..., description="Error message")
     details: Optional[str] = Field(None, description="Additional error details")
-    timestamp: str = Field(default_factory=lambda: datetime.now().isoformat()) 
\ No newline at end of file
+    timestamp: str = Field(default_factory=now_iso) 
\ No newline at end of file
@@ -0,0 +1,134 @@
+"""
+Session store for AI-Powered CRM MVP
+Bounded LRU + TTL cache for agent sessions
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+class SessionStore:
+    """
+    Maps session IDs to session data with bounded size and idle expiry.
+    Sessions are spread over independent shards so eviction and expiry
+    sweeps only touch the shard being accessed. Within a shard the least
+    recently used session is evicted once it is full, and sessions not
+    touched for ttl seconds expire.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 10_000,
+        ttl: float = 3600,
+        on_evict: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+        shards: int = 16
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._shard_maxsize = max(1, -(-maxsize // shards))
+        # Each shard is ordered from least to most recently used: (last_used, session_data)
+        self._shards: List["OrderedDict[str, Tuple[float, Dict[str, Any]]]"] = [
+            OrderedDict() for _ in range(shards)
+        ]
+        self._locks = [asyncio.Lock() for _ in range(shards)]
+
+    def _shard_index(self, session_id: str) -> int:
+        return (hash(session_id) & 0x7FFFFFFF) % len(self._shards)
+
+    def _shard(self, session_id: str) -> "OrderedDict[str, Tuple[float, Dict[str, Any]]]":
+        shard = self._shards[self._shard_index(session_id)]
+        self._expire(shard)
+        return shard
+
+    def lock(self, session_id: str) -> asyncio.Lock:
+        """Lock guarding the shard that holds session_id"""
+        return self._locks[self._shard_index(session_id)]
+
+    def _evict(self, session_id: str, session: Dict[str, Any]):
+        """Notify the owner that a session was dropped by the cache"""
+        if self.on_evict:
+            self.on_evict(session_id, session)
+
+    def _expire(self, shard: "OrderedDict[str, Tuple[float, Dict[str, Any]]]"):
+        """Drop sessions in a shard that have been idle for longer than ttl"""
+        cutoff = time.monotonic() - self.ttl
+        while shard:
+            session_id, (last_used, session) = next(iter(shard.items()))
+            if last_used > cutoff:
+                break
+            del shard[session_id]
+            self._evict(session_id, session)
+
+    def expire(self) -> int:
+        """Drop idle sessions from every shard, returning how many were removed"""
+        before = sum(len(shard) for shard in self._shards)
+        return before - len(self)
+
+    def _live_shards(self) -> List["OrderedDict[str, Tuple[float, Dict[str, Any]]]"]:
+        for shard in self._shards:
+            self._expire(shard)
+        return self._shards
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._shard(session_id)
+
+    def __getitem__(self, session_id: str) -> Dict[str, Any]:
+        shard = self._shard(session_id)
+        _, session = shard[session_id]
+        shard[session_id] = (time.monotonic(), session)
+        shard.move_to_end(session_id)
+        return session
+
+    def __setitem__(self, session_id: str, session: Dict[str, Any]):
+        shard = self._shard(session_id)
+        shard[session_id] = (time.monotonic(), session)
+        shard.move_to_end(session_id)
+        while len(shard) > self._shard_maxsize:
+            evicted_id, (_, evicted) = shard.popitem(last=False)
+            self._evict(evicted_id, evicted)
+
+    def __delitem__(self, session_id: str):
+        del self._shard(session_id)[session_id]
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._live_shards())
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def get(self, session_id: str, default: Any = None) -> Any:
+        try:
+            return self[session_id]
+        except KeyError:
+            return default
+
+    def pop(self, session_id: str, default: Any = None) -> Any:
+        """Remove a session without triggering the eviction callback"""
+        entry = self._shard(session_id).pop(session_id, None)
+        return entry[1] if entry else default
+
+    def keys(self) -> List[str]:
+        return [session_id for shard in self._live_shards() for session_id in shard]
+
+    def values(self) -> List[Dict[str, Any]]:
+        return [session for shard in self._live_shards() for _, session in shard.values()]
+
+    def items(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Snapshot of (session_id, session) pairs, safe to iterate across awaits"""
+        return [
+            (session_id, session)
+            for shard in self._live_shards()
+            for session_id, (_, session) in shard.items()
+        ]
+
+    async def clear(self) -> int:
+        """Remove every session, one shard at a time under its own lock"""
+        removed = 0
+        for shard, lock in zip(self._shards, self._locks):
+            async with lock:
+                removed += len(shard)
+                shard.clear()
+        return removed
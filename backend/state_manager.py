@@ -3,11 +3,12 @@ State manager for AI-Powered CRM MVP
 Handles in-memory state and JSON file persistence
 """
 
-import json
 import os
 import asyncio
-from typing import Dict, List, Optional, Any
-from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiofiles
+import orjson
 
 from backend.models import (
     ApplicationState, 
@@ -18,16 +19,83 @@ from backend.models import (
     KanbanColumn,
     KanbanCard
 )
+from backend.timestamps import now_iso
+
+# Journal entries are written in batches of up to JOURNAL_BATCH_SIZE,
+# waiting at most JOURNAL_BATCH_WINDOW seconds for a batch to fill
+JOURNAL_BATCH_SIZE = 64
+JOURNAL_BATCH_WINDOW = 0.05
+
+# Changes are saved once no further change has arrived for SAVE_DEBOUNCE seconds,
+# and at most SAVE_MAX_DELAY seconds after the first unsaved change
+SAVE_DEBOUNCE = 0.5
+SAVE_MAX_DELAY = 5.0
+
+# Live handles and process-local timers in agent session data; they are not
+# written to the state file or the Redis session store
+RUNTIME_SESSION_KEYS = frozenset(("engine", "state_cache", "l2_refreshed_at"))
+
+# Rarely-changing ApplicationState fields, saved to their own config file so
+# lead and conversation updates do not rewrite them
+CONFIG_FIELDS = frozenset(("business_data", "pipeline_payload", "session_state"))
+
+# Each conversation keeps its most recent CONVERSATION_HISTORY_LIMIT messages;
+# older ones are dropped CONVERSATION_TRIM_BATCH at a time
+CONVERSATION_HISTORY_LIMIT = 500
+CONVERSATION_TRIM_BATCH = 50
+
+# LeadData fields taken from an incoming update of an existing lead
+LEAD_UPDATE_FIELDS = (
+    "name", "type", "company", "website", "phone", "email",
+    "address", "requirements", "notes", "stage", "user_tags"
+)
+
+
+def _append_capped(history: List[Dict[str, str]], record: Dict[str, str]):
+    """Append a message to a conversation, trimming the oldest past the history limit"""
+    history.append(record)
+    if len(history) > CONVERSATION_HISTORY_LIMIT + CONVERSATION_TRIM_BATCH:
+        del history[:-CONVERSATION_HISTORY_LIMIT]
 
 class StateManager:
     """
     Manages application state in memory with JSON file persistence
+    Business data, pipeline and ready state live in a separate config file
+    that is only rewritten when they change. Conversation messages are also
+    appended to a journal as they arrive, so they survive a crash between
+    full saves
     """
     
-    def __init__(self, state_file: str = "state.json"):
+    def __init__(
+        self,
+        state_file: str = "state.json",
+        on_card_change: Optional[Callable[[KanbanCard, Optional[int], int], Awaitable[None]]] = None
+    ):
         self.state_file = state_file
+        # Awaited with (card, previous stage or None, current stage) whenever a Kanban card changes
+        self.on_card_change = on_card_change
+        self.config_file = f"{os.path.splitext(state_file)[0]}.config.json"
+        self.journal_file = f"{state_file}.journal"
         self.state = ApplicationState()
         self._save_task = None
+        # Set when the state / config file is out of date
+        self._dirty = False
+        self._config_dirty = False
+        self._flush_event = asyncio.Event()
+        self._journal_queue: Optional[asyncio.Queue] = None
+        self._journal_task = None
+        # Journal entries are numbered; entries up to _journal_covered are already
+        # in the saved snapshot. _file_lock keeps journal appends out of a save
+        self._journal_seq = 0
+        self._journal_covered = 0
+        self._file_lock = asyncio.Lock()
+        # Leads by session_id
+        self._leads_by_session: Dict[str, LeadData] = {}
+        # Kanban lookups: stage number -> column, lead session_id -> (stage, card)
+        self._columns_by_stage: Dict[int, KanbanColumn] = {}
+        self._card_index: Dict[str, Tuple[int, KanbanCard]] = {}
+        # Bumped whenever state served to the frontend changes
+        self.version = 0
         
         print(f"📊 State Manager initialized with file: {state_file}")
     
@@ -35,11 +103,18 @@ class StateManager:
         """Load state from JSON file if it exists"""
         try:
             if os.path.exists(self.state_file):
-                with open(self.state_file, 'r') as f:
-                    data = json.load(f)
+                # Validate straight from the file bytes, skipping the intermediate dicts
+                async with aiofiles.open(self.state_file, 'rb') as f:
+                    state = ApplicationState.model_validate_json(await f.read())
                 
-                # Convert dict back to ApplicationState
-                self.state = ApplicationState(**data)
+                # Files from before the config split hold every field in the state file
+                if os.path.exists(self.config_file):
+                    async with aiofiles.open(self.config_file, 'rb') as f:
+                        config = ApplicationState.model_validate_json(await f.read())
+                    for field in config.model_fields_set:
+                        setattr(state, field, getattr(config, field))
+                
+                self.state = state
                 
                 print(f"📥 Loaded state from {self.state_file}")
                 print(f"   - Business: {self.state.business_data.biz_name}")
@@ -52,35 +127,78 @@ class StateManager:
         except Exception as e:
             print(f"❌ Error loading state: {str(e)}")
             self.state = ApplicationState()  # Start fresh if load fails
+        
+        self._replay_journal()
+        self._index_leads()
+        # The Kanban board is derived from the pipeline and leads and is not saved
+        self.state.kanban_board = KanbanBoard()
+        await self._rebuild_kanban_board()
+        self._index_kanban_board()
+        self._changed(config=True)
+    
+    @staticmethod
+    async def _write_json(path: str, data: Dict[str, Any]):
+        """Write a temp file and swap it in, so a crash mid-write never leaves a truncated file"""
+        tmp_file = f"{path}.tmp"
+        async with aiofiles.open(tmp_file, 'wb') as f:
+            await f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        os.replace(tmp_file, path)
     
     async def save_state(self):
-        """Save current state to JSON file"""
-        try:
-            # Update last_updated timestamp
-            self.state.last_updated = datetime.now().isoformat()
-            
-            # Convert to dict and save
-            state_dict = self.state.model_dump()
-            
-            with open(self.state_file, 'w') as f:
-                json.dump(state_dict, f, indent=2, ensure_ascii=False)
-            
-            print(f"💾 State saved to {self.state_file}")
-            
-        except Exception as e:
-            print(f"❌ Error saving state: {str(e)}")
+        """Save current state to JSON file, and the config file if it changed"""
+        # The journal writer waits while a save is in progress
+        async with self._file_lock:
+            save_config = False
+            try:
+                # Update last_updated timestamp
+                self.state.last_updated = now_iso()
+                
+                # Snapshot the state, noting the last journal entry it includes;
+                # changes made from here on need another save
+                covered = self._journal_seq
+                save_config = self._config_dirty
+                self._dirty = self._config_dirty = False
+                state_data = self.state.model_dump(exclude=CONFIG_FIELDS | {"kanban_board"})
+                config_data = self.state.model_dump(include=CONFIG_FIELDS) if save_config else None
+                
+                if config_data is not None:
+                    await self._write_json(self.config_file, config_data)
+                await self._write_json(self.state_file, state_data)
+                
+                # Everything journaled so far is now in the snapshot; entries still
+                # queued up to `covered` are skipped by the writer
+                if os.path.exists(self.journal_file):
+                    os.remove(self.journal_file)
+                self._journal_covered = covered
+                
+                print(f"💾 State saved to {self.state_file}")
+                
+            except Exception as e:
+                self._dirty = True
+                self._config_dirty = self._config_dirty or save_config
+                print(f"❌ Error saving state: {str(e)}")
     
-    def start_auto_save(self, interval: int = 30):
-        """Start auto-save task that runs every interval seconds"""
+    def start_auto_save(self, debounce: float = SAVE_DEBOUNCE, max_delay: float = SAVE_MAX_DELAY):
+        """Start auto-save task that saves changes once they settle for debounce seconds"""
         if self._save_task is None:
-            self._save_task = asyncio.create_task(self._auto_save_loop(interval))
-            print(f"⏰ Auto-save started (every {interval}s)")
+            self._save_task = asyncio.create_task(self._auto_save_loop(debounce, max_delay))
+            print(f"⏰ Auto-save started (after {debounce}s without changes, at most every {max_delay}s)")
     
-    async def _auto_save_loop(self, interval: int):
-        """Auto-save loop"""
+    async def _auto_save_loop(self, debounce: float, max_delay: float):
+        """Auto-save loop: a burst of changes is written with a single save"""
+        loop = asyncio.get_running_loop()
         while True:
-            await asyncio.sleep(interval)
-            await self.save_state()
+            await self._flush_event.wait()
+            # Keep waiting while changes are still arriving, but never past the deadline,
+            # so a steady stream of changes is still saved every max_delay seconds
+            deadline = loop.time() + max_delay
+            while True:
+                self._flush_event.clear()
+                await asyncio.sleep(max(0.0, min(debounce, deadline - loop.time())))
+                if not self._flush_event.is_set() or loop.time() >= deadline:
+                    break
+            if self._dirty or self._config_dirty:
+                await self.save_state()
     
     def stop_auto_save(self):
         """Stop auto-save task"""
@@ -89,10 +207,109 @@ class StateManager:
             self._save_task = None
             print("⏰ Auto-save stopped")
     
+    def _mark_dirty(self, config: bool = False):
+        """Note that the state file (and optionally the config file) is out of date and schedule an auto-save"""
+        self._dirty = True
+        self._config_dirty = self._config_dirty or config
+        self._flush_event.set()
+    
+    def _changed(self, config: bool = False):
+        """Mark the frontend-visible state (business, pipeline, leads) as modified"""
+        self.version += 1
+        self._mark_dirty(config)
+    
+    # Journal Methods
+    def start_journal(self):
+        """Start the task that appends conversation messages to the journal"""
+        if self._journal_task is None:
+            self._journal_queue = asyncio.Queue()
+            self._journal_task = asyncio.create_task(self._journal_writer())
+            print(f"📓 Journaling conversations to {self.journal_file}")
+    
+    async def stop_journal(self):
+        """Write out queued journal entries and stop the journal task"""
+        if self._journal_task:
+            await self._journal_queue.join()
+            self._journal_task.cancel()
+            self._journal_task = None
+            self._journal_queue = None
+    
+    def _journal(self, entry: Dict[str, Any]):
+        """Queue an entry for the journal without waiting for the write"""
+        self._journal_seq += 1
+        if self._journal_queue is not None:
+            self._journal_queue.put_nowait((self._journal_seq, entry))
+    
+    async def _journal_writer(self):
+        """Append queued entries to the journal file in small batches"""
+        loop = asyncio.get_running_loop()
+        queue = self._journal_queue
+        while True:
+            entries = [await queue.get()]
+            deadline = loop.time() + JOURNAL_BATCH_WINDOW
+            while len(entries) < JOURNAL_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    entries.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            try:
+                async with self._file_lock:
+                    # Entries taken by a save that ran meanwhile are already on disk
+                    lines = b"".join(
+                        orjson.dumps(entry) + b"\n"
+                        for seq, entry in entries if seq > self._journal_covered
+                    )
+                    if lines:
+                        async with aiofiles.open(self.journal_file, "ab") as f:
+                            await f.write(lines)
+            except Exception as e:
+                print(f"❌ Error writing journal: {str(e)}")
+            finally:
+                for _ in entries:
+                    queue.task_done()
+    
+    def _replay_journal(self):
+        """Apply journal entries written after the last full save"""
+        if not os.path.exists(self.journal_file):
+            return
+        
+        replayed = 0
+        try:
+            with open(self.journal_file, 'rb') as f:
+                for line in f:
+                    try:
+                        entry = orjson.loads(line)
+                    except ValueError:
+                        continue  # Torn final line from a crash mid-write
+                    self._apply_journal_entry(entry)
+                    replayed += 1
+        except Exception as e:
+            print(f"❌ Error replaying journal: {str(e)}")
+        
+        if replayed:
+            print(f"📓 Replayed {replayed} journaled conversation messages")
+    
+    def _apply_journal_entry(self, entry: Dict[str, Any]):
+        """Apply one journal entry to the in-memory state"""
+        record = {
+            "message": entry["message"],
+            "response": entry["response"],
+            "timestamp": entry["timestamp"]
+        }
+        if entry["type"] == "owner_message":
+            _append_capped(self.state.owner_conversations, record)
+        elif entry["type"] == "lead_message":
+            _append_capped(self.state.lead_conversations.setdefault(entry["session_id"], []), record)
+    
     # Business Data Methods
     async def update_business_data(self, business_data: BusinessData):
         """Update business configuration"""
         self.state.business_data = business_data
+        self._changed(config=True)
         print(f"🏢 Updated business data: {business_data.biz_name}")
     
     async def get_business_data(self) -> BusinessData:
@@ -112,6 +329,7 @@ class StateManager:
         
         # Rebuild Kanban board
         await self._rebuild_kanban_board()
+        self._changed(config=True)
         
         print(f"📋 Updated pipeline: {pipeline.biz_name} ({pipeline.total_stages} stages)")
     
@@ -123,34 +341,37 @@ class StateManager:
     async def add_lead(self, lead: LeadData):
         """Add a new lead"""
         # Check if lead already exists (by session_id)
-        existing_lead = next(
-            (l for l in self.state.leads if l.session_id == lead.session_id), 
-            None
-        )
+        existing_lead = self._leads_by_session.get(lead.session_id)
         
         if existing_lead:
+            # The same data is often synced again after every lead message; leave
+            # the lead, its card and the saved state alone when nothing changed
+            if existing_lead is not lead and all(
+                getattr(existing_lead, field) == getattr(lead, field) for field in LEAD_UPDATE_FIELDS
+            ):
+                return
+            
             # Update existing lead
-            existing_lead.name = lead.name
-            existing_lead.type = lead.type
-            existing_lead.company = lead.company
-            existing_lead.website = lead.website
-            existing_lead.phone = lead.phone
-            existing_lead.email = lead.email
-            existing_lead.address = lead.address
-            existing_lead.requirements = lead.requirements
-            existing_lead.notes = lead.notes
-            existing_lead.stage = lead.stage
-            existing_lead.user_tags = lead.user_tags
-            existing_lead.updated_at = datetime.now().isoformat()
+            for field in LEAD_UPDATE_FIELDS:
+                setattr(existing_lead, field, getattr(lead, field))
+            existing_lead.updated_at = now_iso()
             
             print(f"📝 Updated lead: {lead.name} (Stage {lead.stage})")
         else:
             # Add new lead
             self.state.leads.append(lead)
+            self._leads_by_session[lead.session_id] = lead
             print(f"➕ Added new lead: {lead.name} (Stage {lead.stage})")
         
         # Update Kanban board
         await self._update_kanban_card(lead)
+        self._changed()
+    
+    def _index_leads(self):
+        """Rebuild the session_id lookup from the lead list (first lead wins, as in a scan)"""
+        self._leads_by_session = {}
+        for lead in self.state.leads:
+            self._leads_by_session.setdefault(lead.session_id, lead)
     
     async def get_leads(self) -> List[LeadData]:
         """Get all leads"""
@@ -158,10 +379,7 @@ class StateManager:
     
     async def get_lead_by_session(self, session_id: str) -> Optional[LeadData]:
         """Get lead by session ID"""
-        return next(
-            (lead for lead in self.state.leads if lead.session_id == session_id), 
-            None
-        )
+        return self._leads_by_session.get(session_id)
     
     async def move_lead_to_stage(self, session_id: str, new_stage: int):
         """Move a lead to a different stage"""
@@ -169,21 +387,24 @@ class StateManager:
         if lead:
             old_stage = lead.stage
             lead.stage = new_stage
-            lead.updated_at = datetime.now().isoformat()
+            lead.updated_at = now_iso()
             
             print(f"🔄 Moved lead {lead.name} from stage {old_stage} to {new_stage}")
             
             # Update Kanban board
             await self._update_kanban_card(lead)
+            self._changed()
     
     # Conversation Methods
     async def add_owner_message(self, message: str, response: str):
         """Add owner conversation"""
-        self.state.owner_conversations.append({
+        record = {
             "message": message,
             "response": response,
-            "timestamp": datetime.now().isoformat()
-        })
+            "timestamp": now_iso()
+        }
+        _append_capped(self.state.owner_conversations, record)
+        self._journal({"type": "owner_message", **record})
         
         print(f"💬 Added owner conversation (total: {len(self.state.owner_conversations)})")
     
@@ -192,11 +413,13 @@ class StateManager:
         if session_id not in self.state.lead_conversations:
             self.state.lead_conversations[session_id] = []
         
-        self.state.lead_conversations[session_id].append({
+        record = {
             "message": message,
             "response": response,
-            "timestamp": datetime.now().isoformat()
-        })
+            "timestamp": now_iso()
+        }
+        _append_capped(self.state.lead_conversations[session_id], record)
+        self._journal({"type": "lead_message", "session_id": session_id, **record})
         
         print(f"💬 Added lead conversation for {session_id}")
     
@@ -222,71 +445,101 @@ class StateManager:
             columns.append(column)
         
         # Add leads to appropriate columns
+        columns_by_stage: Dict[int, KanbanColumn] = {}
+        for column in columns:
+            columns_by_stage.setdefault(column.stage_number, column)
         for lead in self.state.leads:
-            card = KanbanCard(
-                id=lead.session_id,
-                lead_name=lead.name or f"Lead {lead.session_id[:8]}",
-                lead_type=lead.type,
-                user_tags=lead.user_tags,
-                stage=lead.stage,
-                updated_at=lead.updated_at
-            )
-            
-            # Add card to appropriate column
-            for column in columns:
-                if column.stage_number == lead.stage:
-                    column.cards.append(card)
-                    break
+            column = columns_by_stage.get(lead.stage)
+            if column is not None:
+                column.cards.append(self._make_kanban_card(lead))
         
         # Update board
         self.state.kanban_board = KanbanBoard(
             business_name=self.state.business_data.biz_name,
             columns=columns,
             total_leads=len(self.state.leads),
-            updated_at=datetime.now().isoformat()
+            updated_at=now_iso()
         )
+        self._index_kanban_board()
         
         print(f"🗂️  Rebuilt Kanban board with {len(columns)} columns and {len(self.state.leads)} leads")
     
+    @staticmethod
+    def _make_kanban_card(lead: LeadData) -> KanbanCard:
+        """Build a lead's card from already-validated lead data, skipping validation"""
+        return KanbanCard.model_construct(
+            id=lead.session_id,
+            lead_name=lead.name or f"Lead {lead.session_id[:8]}",
+            lead_type=lead.type,
+            user_tags=list(lead.user_tags),
+            stage=lead.stage,
+            updated_at=lead.updated_at
+        )
+    
+    def _index_kanban_board(self):
+        """Rebuild the column and card lookups from the current Kanban board"""
+        self._columns_by_stage = {}
+        self._card_index = {}
+        for column in self.state.kanban_board.columns:
+            self._columns_by_stage.setdefault(column.stage_number, column)
+            for card in column.cards:
+                self._card_index[card.id] = (column.stage_number, card)
+    
     async def _update_kanban_card(self, lead: LeadData):
         """Update a specific card in the Kanban board"""
         if not self.state.pipeline_payload:
             return
         
-        # Find and update/create the card
-        card_updated = False
-        
-        for column in self.state.kanban_board.columns:
-            # Remove card from wrong column
-            column.cards = [c for c in column.cards if c.id != lead.session_id]
+        previous = self._card_index.get(lead.session_id)
+        from_stage = previous[0] if previous is not None else None
+        if from_stage == lead.stage:
+            # Same stage: refresh the existing card in place
+            card = previous[1]
+            card.lead_name = lead.name or f"Lead {lead.session_id[:8]}"
+            card.lead_type = lead.type
+            card.user_tags = list(lead.user_tags)
+            card.updated_at = lead.updated_at
+        else:
+            # Take the lead's current card out of its column
+            if previous is not None:
+                del self._card_index[lead.session_id]
+                stage, old_card = previous
+                column = self._columns_by_stage.get(stage)
+                if column is not None:
+                    for i, card in enumerate(column.cards):
+                        if card is old_card:
+                            del column.cards[i]
+                            break
             
             # Add card to correct column
-            if column.stage_number == lead.stage:
-                card = KanbanCard(
-                    id=lead.session_id,
-                    lead_name=lead.name or f"Lead {lead.session_id[:8]}",
-                    lead_type=lead.type,
-                    user_tags=lead.user_tags,
-                    stage=lead.stage,
-                    updated_at=lead.updated_at
-                )
-                column.cards.append(card)
-                card_updated = True
+            column = self._columns_by_stage.get(lead.stage)
+            if column is None:
+                return
+            
+            card = self._make_kanban_card(lead)
+            column.cards.append(card)
+            self._card_index[lead.session_id] = (lead.stage, card)
         
-        if card_updated:
-            self.state.kanban_board.total_leads = len(self.state.leads)
-            self.state.kanban_board.updated_at = datetime.now().isoformat()
-            print(f"🗂️  Updated Kanban card for {lead.name}")
+        self.state.kanban_board.total_leads = len(self.state.leads)
+        self.state.kanban_board.updated_at = now_iso()
+        print(f"🗂️  Updated Kanban card for {lead.name}")
+        
+        if self.on_card_change:
+            await self.on_card_change(card, from_stage, lead.stage)
     
     # Session Management
     async def add_active_session(self, session_id: str, session_data: Dict[str, Any]):
-        """Add an active session"""
-        self.state.active_sessions[session_id] = session_data
+        """Add an active session, keeping only its serializable metadata"""
+        self.state.active_sessions[session_id] = {
+            k: v for k, v in session_data.items() if k not in RUNTIME_SESSION_KEYS
+        }
+        self._mark_dirty()
     
     async def remove_active_session(self, session_id: str):
         """Remove an active session"""
         if session_id in self.state.active_sessions:
             del self.state.active_sessions[session_id]
+            self._mark_dirty()
             print(f"🗑️  Removed session: {session_id}")
     
     async def get_active_sessions(self) -> Dict[str, Dict[str, Any]]:
@@ -296,21 +549,8 @@ class StateManager:
     def save_session_state(self, session_state: Dict[str, Any]) -> None:
         """Save complete session state for ready state preparation"""
         self.state.session_state = session_state
-        # Create a task to save state asynchronously without blocking
-        import asyncio
-        try:
-            # Try to get the current event loop
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                # If loop is running, create a task
-                asyncio.create_task(self.save_state())
-            else:
-                # If no loop is running, run the coroutine
-                asyncio.run(self.save_state())
-        except RuntimeError:
-            # Fallback: just update the state without saving to file immediately
-            # The state will be saved on the next auto-save or shutdown
-            pass
+        # The auto-save task writes it out off the request path, coalescing bursts
+        self._changed(config=True)
         print("Session state saved")
 
     def get_session_state(self) -> Dict[str, Any]:
@@ -338,6 +578,9 @@ class StateManager:
         
         # Reset to fresh state
         self.state = ApplicationState()
+        self._index_leads()
+        self._index_kanban_board()
+        self._changed(config=True)
         
         # Save the reset state
         await self.save_state()
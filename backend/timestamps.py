@@ -0,0 +1,25 @@
+"""
+Timestamp helpers for AI-Powered CRM MVP
+Cached ISO timestamps for hot paths
+"""
+
+import time
+from datetime import datetime
+
+# Timestamps within this many seconds of each other share one formatted string
+TIMESTAMP_GRANULARITY = 0.1
+
+# (time the cached string was formatted, formatted string)
+_last_timestamp = [0.0, ""]
+
+
+def now_iso() -> str:
+    """
+    Current local time as an ISO string, same format as datetime.now().isoformat()
+    The string is reformatted at most every TIMESTAMP_GRANULARITY seconds
+    """
+    now = time.time()
+    if now - _last_timestamp[0] >= TIMESTAMP_GRANULARITY:
+        _last_timestamp[1] = datetime.fromtimestamp(now).isoformat()
+        _last_timestamp[0] = now
+    return _last_timestamp[1]
@@ -5,27 +5,42 @@ Handles real-time updates and connections
 
 import json
 import asyncio
-from typing import Dict, List, Any, Optional
-from datetime import datetime
+from typing import Dict, List, Any, Optional, Union
 
+import orjson
 from fastapi import WebSocket, WebSocketDisconnect
-from backend.models import WebSocketMessage, PipelinePayload, LeadData, KanbanBoard
+from backend.models import PipelinePayload, LeadData, KanbanBoard, KanbanCard
+from backend.timestamps import now_iso
+
+# Messages buffered per client before the oldest ones are dropped
+OUTBOX_SIZE = 32
 
 class WebSocketManager:
     """
     Manages WebSocket connections and broadcasts real-time updates
+    Each client has a bounded outbox drained by its own sender task, so a
+    slow client never holds up a broadcast or the request that triggered it
     """
     
     def __init__(self):
         # Store active connections
         self.active_connections: Dict[str, WebSocket] = {}
+        self._outboxes: Dict[str, asyncio.Queue] = {}
+        self._senders: Dict[str, asyncio.Task] = {}
         
         print("🔌 WebSocket Manager initialized")
     
     async def connect(self, websocket: WebSocket, client_id: str):
         """Accept a WebSocket connection"""
         await websocket.accept()
+        
+        # A reconnecting client replaces its previous connection
+        self.disconnect(client_id)
+        
+        outbox = asyncio.Queue(maxsize=OUTBOX_SIZE)
         self.active_connections[client_id] = websocket
+        self._outboxes[client_id] = outbox
+        self._senders[client_id] = asyncio.create_task(self._sender(client_id, websocket, outbox))
         
         print(f"🔗 WebSocket connected: {client_id} (total: {len(self.active_connections)})")
         
@@ -40,29 +55,58 @@ class WebSocketManager:
         """Remove a WebSocket connection"""
         if client_id in self.active_connections:
             del self.active_connections[client_id]
+            self._outboxes.pop(client_id, None)
+            sender = self._senders.pop(client_id, None)
+            if sender is not None and sender is not asyncio.current_task():
+                sender.cancel()
             print(f"🔗 WebSocket disconnected: {client_id} (remaining: {len(self.active_connections)})")
     
-    async def send_to_client(self, client_id: str, data: Dict[str, Any]):
-        """Send data to a specific client"""
-        if client_id in self.active_connections:
+    async def _sender(self, client_id: str, websocket: WebSocket, outbox: asyncio.Queue):
+        """Send queued messages to one client until it goes away"""
+        while True:
+            frame = await outbox.get()
             try:
-                websocket = self.active_connections[client_id]
-                
-                # Create WebSocket message
-                message = WebSocketMessage(
-                    type=data.get("type", "message"),
-                    data=data
-                )
-                
-                # Send as JSON
-                await websocket.send_text(message.model_dump_json())
-                
+                if isinstance(frame, bytes):
+                    await websocket.send_bytes(frame)
+                else:
+                    await websocket.send_text(frame)
             except WebSocketDisconnect:
                 # Connection was closed, remove it
                 self.disconnect(client_id)
+                return
             except Exception as e:
                 print(f"❌ Error sending to {client_id}: {str(e)}")
                 self.disconnect(client_id)
+                return
+    
+    def _enqueue(self, client_id: str, frame: Union[str, bytes]):
+        """Queue a frame for a client, dropping its oldest frame if the outbox is full"""
+        outbox = self._outboxes.get(client_id)
+        if outbox is None:
+            return
+        try:
+            outbox.put_nowait(frame)
+        except asyncio.QueueFull:
+            outbox.get_nowait()
+            outbox.put_nowait(frame)
+    
+    def send_frame(self, client_id: str, frame: Union[str, bytes]):
+        """Queue a raw frame for a client: str goes out as a text frame, bytes as a binary frame"""
+        self._enqueue(client_id, frame)
+    
+    @staticmethod
+    def _encode(message_type: str, data: Dict[str, Any]) -> str:
+        """Encode a message in the WebSocketMessage format as a JSON text frame"""
+        return orjson.dumps({
+            "type": message_type,
+            "data": data,
+            "timestamp": now_iso()
+        }).decode()
+    
+    async def send_to_client(self, client_id: str, data: Dict[str, Any]):
+        """Send data to a specific client"""
+        if client_id in self.active_connections:
+            self._enqueue(client_id, self._encode(data.get("type", "message"), data))
     
     async def broadcast(self, data: Dict[str, Any], exclude: Optional[List[str]] = None):
         """Broadcast data to all connected clients"""
@@ -71,32 +115,13 @@ class WebSocketManager:
         
         exclude = exclude or []
         
-        # Create WebSocket message
-        message = WebSocketMessage(
-            type=data.get("type", "broadcast"),
-            data=data
-        )
-        
-        message_json = message.model_dump_json()
-        disconnected_clients = []
+        # Encoded once; every client's outbox shares the same frame
+        message_json = self._encode(data.get("type", "broadcast"), data)
         
-        # Send to all clients except excluded ones
-        for client_id, websocket in self.active_connections.items():
+        # Queue for all clients except excluded ones; their sender tasks do the I/O
+        for client_id in self.active_connections:
             if client_id not in exclude:
-                try:
-                    await websocket.send_text(message_json)
-                except WebSocketDisconnect:
-                    disconnected_clients.append(client_id)
-                except Exception as e:
-                    print(f"❌ Error broadcasting to {client_id}: {str(e)}")
-                    disconnected_clients.append(client_id)
-        
-        # Remove disconnected clients
-        for client_id in disconnected_clients:
-            self.disconnect(client_id)
-        
-        if disconnected_clients:
-            print(f"🧹 Cleaned up {len(disconnected_clients)} disconnected clients")
+                self._enqueue(client_id, message_json)
     
     # Specific broadcast methods for different update types
     
@@ -120,12 +145,28 @@ class WebSocketManager:
         
         print(f"📡 Broadcasted lead update: {lead.name}")
     
+    async def broadcast_kanban_card(self, card: KanbanCard, from_stage: Optional[int], to_stage: int):
+        """Broadcast a single Kanban card change instead of the whole board"""
+        await self.broadcast({
+            "type": "kanban_card_moved" if from_stage != to_stage else "kanban_card_updated",
+            "card": card.model_dump(),
+            "from_stage": from_stage,
+            "to_stage": to_stage
+        })
+    
+    async def send_kanban_board(self, client_id: str, board: KanbanBoard):
+        """Send the full Kanban board to one client, e.g. right after it connects"""
+        await self.send_to_client(client_id, {
+            "type": "kanban_board",
+            "board": board.model_dump()
+        })
+    
     async def broadcast_state_reset(self):
         """Broadcast state reset to all clients"""
         await self.broadcast({
             "type": "state_reset",
             "message": "Application state has been reset",
-            "timestamp": datetime.now().isoformat()
+            "timestamp": now_iso()
         })
         
         print(f"📡 Broadcasted state reset to all clients")
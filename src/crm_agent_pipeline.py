@@ -3,6 +3,8 @@
 from dotenv import load_dotenv
 import os
 import uuid
+import asyncio
+import functools
 from vertexai import agent_engines
 from utils.utils import (
     handle_upload_and_patch_state,
@@ -15,8 +17,9 @@ load_dotenv()
 CRM_STAGE_AGENT  = os.getenv("CRM_STAGE_AGENT")
 OMNI_STAGE_AGENT = os.getenv("OMNI_STAGE_AGENT")
 
+@functools.lru_cache(maxsize=8)
 def get_engine(agent_id: str):
-    """Returns the Engine object for the given reasoningEngine."""
+    """Returns the Engine object for the given reasoningEngine (cached for the life of the process)."""
     return agent_engines.get(agent_id)
 
 def start_crm_session() -> dict:
@@ -49,6 +52,11 @@ def get_state(engine, user_id: str, session_id: str) -> dict:
     sess = engine.get_session(user_id=user_id, session_id=session_id)
     return sess.get("state", {})
 
+def _pipeline_completed(state: dict) -> bool:
+    """True if the session state marks the pipeline as complete."""
+    # El path pipeline → pipeline_completed puede variar; ajusta si es distinto
+    return bool(state.get("pipeline", {}).get("pipeline_completed", False))
+
 def is_pipeline_complete(engine, user_id: str, session_id: str) -> bool:
     """
     Queries the session and returns True if the pipeline is complete.
@@ -56,18 +64,26 @@ def is_pipeline_complete(engine, user_id: str, session_id: str) -> bool:
     - user_id, session_id: session identifiers.
     """
     sess = engine.get_session(user_id=user_id, session_id=session_id)
+    return _pipeline_completed(sess.get("state", {}))
+
+async def get_session_snapshot(engine, user_id: str, session_id: str) -> tuple[dict, bool]:
+    """
+    Fetches the session once, off the event loop, and returns
+    (state, pipeline_complete) so a poll needs a single round trip.
+    """
+    sess = await asyncio.to_thread(engine.get_session, user_id=user_id, session_id=session_id)
     state = sess.get("state", {})
-    # El path pipeline → pipeline_completed puede variar; ajusta si es distinto
-    return bool(state.get("pipeline", {}).get("pipeline_completed", False))
+    return state, _pipeline_completed(state)
 
-async def prepare_ready_state(engine, user_id: str, session_id: str, current_stage: int = 1) -> dict:
+async def prepare_ready_state(engine, user_id: str, session_id: str, current_stage: int = 1, state: dict = None) -> dict:
     """
     Retrieves the latest CRM session state and builds the ready_state
     to pass to the Omni Stage Agent.
+    Pass the state from get_session_snapshot to skip fetching the session again.
     """
-    # 1) traemos la sesión completa
-    remote_session = engine.get_session(user_id=user_id, session_id=session_id)
-    state = remote_session.get("state", {})
+    # 1) traemos la sesión completa (si no nos la pasaron ya)
+    if state is None:
+        state, _ = await get_session_snapshot(engine, user_id, session_id)
 
     # 2) construimos el ready_state (pasa current_stage=1 si siempre inicias en la etapa 1)
     ready_state = await build_ready_state(session_state=state, current_stage=current_stage)
@@ -82,18 +98,29 @@ def extract_business_data(state: dict) -> dict:
         "business_id": state.get("business_id", ""),
     }
 
+# Campos de cada etapa en el state aplanado (stage_<i>_<campo>) y su valor por defecto
+STAGE_FIELD_DEFAULTS = {
+    "stage_name":       "",
+    "stage_number":     "",
+    "entry_condition":  "",
+    "prompt":           "",
+    "brief_stage_goal": "",
+    "fields":           [],
+    "user_tags":        [],
+}
+
 def build_stages(state: dict) -> list[dict]:
-    """Builds the list of stages based on total_stages."""
+    """Builds the list of stages based on total_stages, in a single pass over the state."""
     total = int(state.get("total_stages", 0))
-    stages = []
-    for i in range(1, total+1):
-        stages.append({
-            "stage_name":       state.get(f"stage_{i}_stage_name", ""),
-            "stage_number":     state.get(f"stage_{i}_stage_number", ""),
-            "entry_condition":  state.get(f"stage_{i}_entry_condition", ""),
-            "prompt":           state.get(f"stage_{i}_prompt", ""),
-            "brief_stage_goal": state.get(f"stage_{i}_brief_stage_goal", ""),
-            "fields":           state.get(f"stage_{i}_fields", []),
-            "user_tags":        state.get(f"stage_{i}_user_tags", []),
-        })
+    stages = [
+        {field: list(default) if isinstance(default, list) else default
+         for field, default in STAGE_FIELD_DEFAULTS.items()}
+        for _ in range(total)
+    ]
+    for key, value in state.items():
+        if not key.startswith("stage_"):
+            continue
+        index, _, field = key[6:].partition("_")
+        if field in STAGE_FIELD_DEFAULTS and index.isdigit() and 1 <= int(index) <= total:
+            stages[int(index) - 1][field] = value
     return stages
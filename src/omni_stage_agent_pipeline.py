@@ -3,16 +3,17 @@
 from dotenv import load_dotenv
 import os
 import uuid
+import functools
 from vertexai import agent_engines
-from crm_agent_pipeline import extract_user_data  # importa la función del CRM pipeline
 
 load_dotenv()
 
 #— Carga de ID desde .env
 OMNI_STAGE_AGENT = os.getenv("OMNI_STAGE_AGENT")
 
+@functools.lru_cache(maxsize=8)
 def get_engine(agent_id: str):
-    """Devuelve el objeto Engine para el reasoningEngine dado."""
+    """Devuelve el objeto Engine para el reasoningEngine dado (cacheado durante toda la vida del proceso)."""
     return agent_engines.get(agent_id)
 
 def start_omni_session(initial_state: dict = None) -> dict:
@@ -4,10 +4,15 @@
 # Add a PDF file to the owner's RAG Corpus
 from dotenv import load_dotenv
 import os, uuid, time
+import asyncio
+import functools
+import threading
 from google.adk.events import Event, EventActions
 from google.cloud import storage
+from google.cloud.storage.retry import DEFAULT_RETRY
 from pathlib import Path
 from mimetypes import guess_type
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple, Dict, Any, List
 import vertexai
 from vertexai.preview import rag
@@ -21,7 +26,13 @@ load_dotenv()  # Esto busca el .env en el root del proyecto
 # Ahora la variable de entorno ya está disponible para Google Cloud
 print("Credenciales:", os.getenv("GOOGLE_APPLICATION_CREDENTIALS"))
 
-from google.cloud import storage
+# Vertex AI project and region for the RAG corpora, read once at import
+PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT")
+LOCATION = os.getenv("GOOGLE_CLOUD_LOCATION")
+
+# Project number and region of the Vertex AI session service that holds the agent sessions
+SESSION_SERVICE_PROJECT = "49793268080"
+SESSION_SERVICE_LOCATION = "us-central1"
 
 client = storage.Client()
 bucket_name = "adk_hackathon_bucket"
@@ -29,29 +40,73 @@ gcs_folder = "crm_demo"
 bucket = client.bucket(bucket_name)
 print(f"✅ Conectado al bucket: {bucket.name}")
 
+# Batch uploads send up to UPLOAD_WORKERS files to GCS at once
+UPLOAD_WORKERS = 8
+_upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="gcs-upload")
+
+# Uploads are resumable, sent GCS_UPLOAD_CHUNK_SIZE bytes per request (a multiple of 256 KiB),
+# and transient failures are retried with exponential backoff for up to GCS_UPLOAD_DEADLINE seconds
+GCS_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+GCS_UPLOAD_DEADLINE = 300
+_upload_retry = DEFAULT_RETRY.with_deadline(GCS_UPLOAD_DEADLINE)
+
+# Storage clients are not shared between threads; each upload thread creates one and reuses it
+_thread_clients = threading.local()
+
+def _get_bucket(name: str) -> storage.Bucket:
+    """Bucket handle on the calling thread's storage client"""
+    thread_client = getattr(_thread_clients, "client", None)
+    if thread_client is None:
+        thread_client = _thread_clients.client = storage.Client()
+    return thread_client.bucket(name)
+
 # Upload a file to Google Cloud Storage
 def upload_to_gcs(local_path: str, bucket_name: str = bucket_name, folder: str = gcs_folder) -> Tuple[str, str]:
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
+    bucket = _get_bucket(bucket_name)
 
     file_path = Path(local_path)
     filename = file_path.name
 
     destination_path = f"{folder}/{filename}"
-    blob = bucket.blob(destination_path)
-    blob.upload_from_filename(str(file_path))
+    blob = bucket.blob(destination_path, chunk_size=GCS_UPLOAD_CHUNK_SIZE)
+    # A retried chunk resumes from the last committed chunk instead of byte 0;
+    # each chunk is verified with CRC32C (google-crc32c's C extension)
+    with open(file_path, "rb") as fh:
+        blob.upload_from_file(
+            fh,
+            size=os.fstat(fh.fileno()).st_size,
+            content_type=guess_type(filename)[0],
+            checksum="crc32c",
+            retry=_upload_retry,
+        )
 
     gcs_uri = f"gs://{bucket_name}/{destination_path}"
     print(f"✅ Subido: {file_path} → {gcs_uri}")
     return filename, gcs_uri
 
+# vertexai.init only needs to run again when the project or location changes
+_vertex_config = None
+
+def _ensure_vertex_init(project_id: str, location: str):
+    global _vertex_config
+    if _vertex_config != (project_id, location):
+        vertexai.init(project=project_id, location=location)
+        _vertex_config = (project_id, location)
+
+# Corpora created in this process: (project, location, owner) -> corpus name
+_owner_corpora: Dict[Tuple[str, str, str], str] = {}
+# One lock per owner, so creating one owner's corpus does not hold up the others;
+# the short-lived _owner_locks_lock only guards the dict of locks
+_owner_locks: Dict[Tuple[str, str, str], threading.Lock] = {}
+_owner_locks_lock = threading.Lock()
+
 # Create a new RAG Corpus for a business owner
 def create_corpus_for_new_owner(project_id: str, location: str, owner_display_name: str) -> str:
     """
     Creates a new, dedicated RAG Corpus for a business owner.
     Returns: The full resource name of the new corpus.
     """
-    vertexai.init(project=project_id, location=location)
+    _ensure_vertex_init(project_id, location)
     
     print(f"Creating new RAG Corpus for {owner_display_name}...")
     corpus = rag.create_corpus(display_name=f"Corpus for {owner_display_name}")
@@ -59,17 +114,44 @@ def create_corpus_for_new_owner(project_id: str, location: str, owner_display_na
     print(f"Successfully created corpus: {corpus.name}")
     return corpus.name # This is the ID you will save, e.g., "projects/..."
 
+# Reuse the corpus already created for a business owner, creating it on first use
+def get_or_create_owner_corpus(project_id: str, location: str, owner_display_name: str) -> str:
+    """
+    Returns the owner's RAG Corpus, creating it only the first time it is needed.
+    The owner's lock keeps concurrent uploads for the same owner from creating two corpora.
+    """
+    key = (project_id, location, owner_display_name)
+    corpus_name = _owner_corpora.get(key)
+    if corpus_name is not None:
+        return corpus_name
+    
+    with _owner_locks_lock:
+        owner_lock = _owner_locks.setdefault(key, threading.Lock())
+    with owner_lock:
+        corpus_name = _owner_corpora.get(key)
+        if corpus_name is None:
+            corpus_name = _owner_corpora[key] = create_corpus_for_new_owner(*key)
+    return corpus_name
+
 # Add a PDF file to the owner's RAG Corpus
 def add_pdf_to_owner_corpus(project_id: str, location: str, owner_corpus_id: str, gcs_pdf_path: str):
     """
     Ingests a PDF from GCS into a specific owner's RAG Corpus.
     """
-    vertexai.init(project=project_id, location=location)
+    add_pdfs_to_owner_corpus(project_id, location, owner_corpus_id, [gcs_pdf_path])
+
+# Add several PDF files to the owner's RAG Corpus with a single import
+def add_pdfs_to_owner_corpus(project_id: str, location: str, owner_corpus_id: str, gcs_pdf_paths: List[str]):
+    """
+    Ingests PDFs from GCS into a specific owner's RAG Corpus.
+    All paths go into one import_files call, so they share one ingestion job.
+    """
+    _ensure_vertex_init(project_id, location)
 
     # These are the correct arguments based on your screenshot.
     response = rag.import_files(
         corpus_name=owner_corpus_id,
-        paths=[gcs_pdf_path],
+        paths=gcs_pdf_paths,
         # You can optionally include chunking configuration here if needed
         transformation_config=TransformationConfig(
             chunking_config=ChunkingConfig(
@@ -78,7 +160,15 @@ def add_pdf_to_owner_corpus(project_id: str, location: str, owner_corpus_id: str
         ),
                                                        )
     )
-    print(f"Started import of {gcs_pdf_path} into corpus {owner_corpus_id}. Response: {response}")
+    print(f"Started import of {', '.join(gcs_pdf_paths)} into corpus {owner_corpus_id}. Response: {response}")
+
+# One SessionService per process, created on first use so its connections are reused
+@functools.lru_cache(maxsize=1)
+def _get_session_service() -> VertexAiSessionService:
+    return VertexAiSessionService(
+        project=SESSION_SERVICE_PROJECT,
+        location=SESSION_SERVICE_LOCATION,
+    )
 
 # Update the session state with a new event
 async def handle_upload_and_patch_state(
@@ -87,54 +177,65 @@ async def handle_upload_and_patch_state(
     user_id: str,
     session_id: str
 ):
-    # 1) Detect MIME type
-    mime_type, _ = guess_type(local_file)
-    mime_type = mime_type or "application/octet-stream"
+    await handle_uploads_and_patch_state(crm_engine_app, [local_file], user_id, session_id)
+
+# Upload several files at once and record them all in a single session event
+async def handle_uploads_and_patch_state(
+    crm_engine_app:str,
+    local_files: List[str],
+    user_id: str,
+    session_id: str
+):
+    # Uploads, corpus creation and ingest use blocking SDK calls, so they run
+    # in worker threads to keep the event loop free during the transfer
+    loop = asyncio.get_running_loop()
+    session_svc = _get_session_service()
     
-    # 2) Upload to GCS
-    filename, gcs_uri = upload_to_gcs(local_file)
+    async def owner_corpus():
+        # 2) Fetch the live session first: an owner who already has a RAG corpus
+        # keeps it, and a new one is only created (or reused) on a miss
+        session = await session_svc.get_session(
+            app_name=crm_engine_app,
+            user_id=user_id,
+            session_id=session_id,
+        )
+        corpus_name = session.state.get("rag_corpus") or await asyncio.to_thread(
+            get_or_create_owner_corpus,
+            project_id=PROJECT_ID,
+            location=LOCATION,
+            owner_display_name=user_id
+        )
+        return session, corpus_name
     
-    # 3) Create (or reuse) a RAG corpus for this owner
-    corpus_name = create_corpus_for_new_owner(
-        project_id=os.getenv("GOOGLE_CLOUD_PROJECT"),
-        location=os.getenv("GOOGLE_CLOUD_LOCATION"),
-        owner_display_name=user_id
+    # 1) Upload every file to GCS in parallel while 2) the owner's corpus is
+    # looked up. The corpus does not depend on the files, so both run at the same time
+    uploaded, (session, corpus_name) = await asyncio.gather(
+        asyncio.gather(*(
+            loop.run_in_executor(_upload_executor, upload_to_gcs, local_file)
+            for local_file in local_files
+        )),
+        owner_corpus()
     )
     
-    # 4) Ingest into that corpus
-    add_pdf_to_owner_corpus(
-        project_id=os.getenv("GOOGLE_CLOUD_PROJECT"),
-        location=os.getenv("GOOGLE_CLOUD_LOCATION"),
+    # 3) Ingest all of them into that corpus with one import
+    await asyncio.to_thread(
+        add_pdfs_to_owner_corpus,
+        project_id=PROJECT_ID,
+        location=LOCATION,
         owner_corpus_id=corpus_name,
-        gcs_pdf_path=gcs_uri
+        gcs_pdf_paths=[gcs_uri for _, gcs_uri in uploaded]
     )
     
-    # 5) Initialize the SessionService with constants
-    session_svc = VertexAiSessionService(
-        project="49793268080",
-        location="us-central1",
-    )
-    
-    # 6) Use the constant app_name
-    #crm_engine_app
-    
-    # 7) Fetch the live session
-    session = await session_svc.get_session(
-        app_name=crm_engine_app,
-        user_id=user_id,
-        session_id=session_id,
-    )
-    
-    # 8) Build the state delta with both uploaded_docs and rag_corpus
+    # 4) Build the state delta with both uploaded_docs and rag_corpus
     current_uploads = session.state.get("uploaded_docs", [])
-    new_upload_entry = {"filename": filename, "gcs_uri": gcs_uri}
+    new_upload_entries = [{"filename": filename, "gcs_uri": gcs_uri} for filename, gcs_uri in uploaded]
     
     delta = {
-        "uploaded_docs": current_uploads + [new_upload_entry],
+        "uploaded_docs": current_uploads + new_upload_entries,
         "rag_corpus": corpus_name
     }
     
-    # 9) Create and append the event
+    # 5) Create and append the event
     evt = Event(
         invocation_id=str(uuid.uuid4()),
         author="system",
@@ -142,10 +243,15 @@ async def handle_upload_and_patch_state(
         actions=EventActions(state_delta=delta),
     )
     
+    # Awaited so the next agent turn already sees uploaded_docs and rag_corpus,
+    # and a failed patch fails the upload instead of marking it done
     await session_svc.append_event(session=session, event=evt)
-    print(f"✅ Session {session_id} patched with uploads & rag_corpus")
+    print(f"✅ Session {session_id} patched with {len(uploaded)} upload(s) & rag_corpus")
 
 
+# Campos del negocio copiados al ready_state (nivel superior, intake_data o pipeline.intake_data)
+BUSINESS_KEYS = ("business_id", "biz_name", "biz_info", "goal", "kb_files")
+
 async def build_ready_state(
     session_state: Dict[str, Any], # Ahora acepta el estado directamente
     current_stage: int = 1
@@ -165,17 +271,10 @@ async def build_ready_state(
     ready["pipeline_completed"]  = st.get("pipeline_completed", False)
 
     # 2) Extrae business/biz_info/goal/kb_files desde el nivel superior o intake_data
-    for k in ("business_id", "biz_name", "biz_info", "goal", "kb_files"):
-        if k in st:
-            ready[k] = st[k]
-        elif "intake_data" in st and k in st["intake_data"]:
-            ready[k] = st["intake_data"][k]
-        elif "pipeline" in st \
-             and "intake_data" in st["pipeline"] \
-             and k in st["pipeline"]["intake_data"]:
-            ready[k] = st["pipeline"]["intake_data"][k]
-        else:
-            ready[k] = [] if k == "kb_files" else ""
+    intake = st.get("intake_data") or {}
+    pipeline_intake = (st.get("pipeline") or {}).get("intake_data") or {}
+    for k in BUSINESS_KEYS:
+        ready[k] = st.get(k, intake.get(k, pipeline_intake.get(k, [] if k == "kb_files" else "")))
 
     # 3) Aplanar cada etapa del pipeline
     stages: List[Dict[str, Any]] = []
@@ -183,39 +282,29 @@ async def build_ready_state(
         stages = st["pipeline"]["stage_design_results"]["stages"]
     
     ready["total_stages"] = len(stages)
+    # Stage numbers may arrive as floats like 1.0; normalize each once (X.0 -> X)
+    # and reuse it for the flattened keys and the stage summary line
+    descriptions: List[str] = []
     for stage in stages:
-        n = stage.get("stage_number") # Get the stage number, potentially a float like 1.0
-
-        # Convert 'n' to an integer for the key, if it's a float like X.0
-        # This part ensures the key for the flattened state is always an integer.
-        key_n = n # Default to n
-        if isinstance(n, float) and n.is_integer():
-            key_n = int(n)
-        elif n is None:
+        sn = stage.get("stage_number", "")
+        if isinstance(sn, float) and sn.is_integer():
+            sn = int(sn)
+        descriptions.append(
+            f"{sn}. {stage.get('stage_name', '')}: {stage.get('brief_stage_goal', '')}\nEntry: {stage.get('entry_condition', '')}"
+        )
+
+        if stage.get("stage_number") is None:
             print(f"Advertencia: Etapa sin 'stage_number' válido o faltante: {stage}")
             continue # Skip this stage if no valid number for key
 
-        for field, value in stage.items():
-            # --- CAMBIO CLAVE AQUÍ: Ajustar el valor antes de asignarlo si es stage_number ---
-            if field == "stage_number":
-                # If the value is a float like X.0, convert it to int X
-                if isinstance(value, float) and value.is_integer():
-                    ready[f"stage_{key_n}_{field}"] = int(value)
-                else:
-                    ready[f"stage_{key_n}_{field}"] = value # Keep as is if not X.0 float
-            else:
-                ready[f"stage_{key_n}_{field}"] = value
+        prefix = f"stage_{sn}_"
+        ready.update({prefix + field: value for field, value in {**stage, "stage_number": sn}.items()})
     
     # 4) Construir contexto de "current stage"
     if stages and 0 < current_stage <= len(stages):
         cs = stages[current_stage - 1] 
         kb_list = ready.get("kb_files", []) 
 
-        # Ensure current_stage_number is also an integer if it came as float
-        current_stage_num_value = cs.get("stage_number")
-        if isinstance(current_stage_num_value, float) and current_stage_num_value.is_integer():
-            current_stage_num_value = int(current_stage_num_value)
-
         ready.update({
             "current_stage":   current_stage,
             "current_artifacts": ", ".join(kb_list),
@@ -224,15 +313,8 @@ async def build_ready_state(
             "current_stage_prompt":     cs.get("prompt", ""),
             "current_stage_fields":     cs.get("fields", {}),
             "current_stage_user_tags":  cs.get("user_tags", []),
-            # Ensure stage_number in this combined string is also int
-            "all_stages_names_and_descriptions_and_entry_conditions":
-                "\n\n".join(
-                    f"{int(s.get('stage_number')) if isinstance(s.get('stage_number'), float) and s.get('stage_number').is_integer() else s.get('stage_number', '')}. {s.get('stage_name', '')}: {s.get('brief_stage_goal', '')}\nEntry: {s.get('entry_condition', '')}"
-                    for s in stages
-                ),
+            "all_stages_names_and_descriptions_and_entry_conditions": "\n\n".join(descriptions),
         })
-        # Add the converted current_stage_number to ready if needed (it's already in ready[f"stage_{key_n}_{field}"])
-        # ready["current_stage_number_value"] = current_stage_num_value # You could add this if you need it separately
     else:
         ready.update({
             "current_stage":   current_stage,